@@ -0,0 +1,80 @@
+"""
+Shared executors and limits for blocking work
+Keeps CPU-heavy jobs off the event loop
+"""
+import os
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+
+def _available_cpus() -> int:
+    """
+    CPUs this process can actually use: the affinity mask, capped by a cgroup
+    CPU quota (os.cpu_count() reports the host's CPUs inside a container)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    # cgroup v2 "quota period", or v1 quota/period files; -1/"max" means unlimited
+    for quota_file, period_file in (
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ):
+        try:
+            with open(quota_file) as f:
+                fields = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    fields.append(f.read().strip())
+            quota, period = fields[0], fields[1]
+            if quota not in ("max", "-1"):
+                cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+            break
+        except (OSError, ValueError, IndexError):
+            continue
+    return cpus
+
+CPU_COUNT = _available_cpus()
+
+# Caps in-flight FFmpeg requests so uploads and their outputs don't pile up on disk
+# (individual ffmpeg processes are further limited by the service's job slots)
+FFMPEG_SEMAPHORE = asyncio.Semaphore(settings.MAX_CONCURRENT_FFMPEG)
+
+# PDF rendering/merging is CPU- and memory-heavy; one pool thread per slot
+PDF_POOL = ThreadPoolExecutor(
+    max_workers=settings.MAX_CONCURRENT_PDF,
+    thread_name_prefix="pdf"
+)
+PDF_SEMAPHORE = asyncio.Semaphore(settings.MAX_CONCURRENT_PDF)
+
+# Caps concurrent crawl requests (deep crawls fan out into many fetches)
+CRAWL_SEMAPHORE = asyncio.Semaphore(settings.MAX_CONCURRENT_CRAWLS)
+
+async def run_pdf(func, *args, **kwargs):
+    """Run a blocking PDF service call in the PDF pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PDF_POOL, partial(func, *args, **kwargs))
+
+# HTML parsing is CPU-bound; lxml releases the GIL while it parses
+PARSE_POOL = ThreadPoolExecutor(
+    max_workers=min(8, CPU_COUNT),
+    thread_name_prefix="parse"
+)
+
+async def run_parse(func, *args):
+    """Run a blocking HTML parse in the parse pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PARSE_POOL, func, *args)
+
+# Tesseract runs as a subprocess per page, so threads are enough to use every core
+OCR_POOL = ThreadPoolExecutor(
+    max_workers=settings.OCR_WORKERS or min(4, CPU_COUNT),
+    thread_name_prefix="ocr"
+)
+
+# Pages are OCRed in parallel, so each Tesseract process sticks to one OpenMP
+# thread instead of every process trying to use every core
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
@@ -2,15 +2,22 @@
 Configuration module for All-in-One API Service
 Optimized for Koyeb free tier constraints
 """
-import os
+from functools import lru_cache
 from pathlib import Path
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
+    # Values are read from the environment (or .env) by pydantic-settings
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=True,
+        frozen=True
+    )
+    
     # Server
-    PORT: int = int(os.getenv("PORT", "8000"))
-    WORKERS: int = int(os.getenv("WORKERS", "2"))
-    MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", "100"))  # MB
+    PORT: int = 8000
+    WORKERS: int = 2
+    MAX_UPLOAD_SIZE: int = 100  # MB
     
     # Storage paths
     BASE_DIR: Path = Path("/app")
@@ -20,21 +27,33 @@ class Settings(BaseSettings):
     TEMP_DIR: Path = STORAGE_DIR / "temp"
     
     # Cleanup
-    CLEANUP_HOURS: int = int(os.getenv("CLEANUP_HOURS", "24"))
+    CLEANUP_HOURS: int = 24
     
     # Resource limits (Koyeb free tier: 2GB RAM, 2 cores)
     MAX_CONCURRENT_REQUESTS: int = 10
+    MAX_CONCURRENT_PDF: int = 2  # PDF renders/merges at once
+    MAX_CONCURRENT_CRAWLS: int = 4  # Crawl requests at once
+    MAX_CONCURRENT_FFMPEG: int = 4  # FFmpeg requests (upload + processing) at once
     MAX_CRAWL_PAGES: int = 50  # Per request
+    CRAWL_CONCURRENCY: int = 5  # Parallel fetches within one deep crawl
     MAX_PDF_PAGES: int = 500
+    MAX_MERGE_DOWNLOAD_SIZE: int = 500  # MB, total per merge-from-urls request
     MAX_VIDEO_DURATION: int = 600  # 10 minutes
     
-    # Crawl4AI
+    # Crawler
     CRAWL_TIMEOUT: int = 60  # seconds
     CRAWL_USER_AGENT: str = "Mozilla/5.0 (compatible; AllInOneService/1.0)"
+    CRAWL_MAX_INFLIGHT: int = 64  # Open crawler sockets across all requests
+    CRAWL_CACHE_SIZE: int = 256  # Fetched pages kept in memory (deep crawls)
+    CRAWL_CACHE_MAX_SIZE: int = 32  # MB, total cached page bodies
+    CRAWL_CACHE_TTL: int = 300  # seconds
     
     # OCR
     TESSERACT_LANG: str = "eng"  # Default language
-    OCR_DPI: int = 300
+    OCR_DPI: int = 300  # Capped at 300
+    OCR_MAX_DIMENSION: int = 2400  # px, longer image edge before OCR
+    OCR_LANGUAGES_TTL: int = 3600  # seconds
+    OCR_WORKERS: int = 0  # Parallel page OCR (0 = available CPUs, up to 4)
     
     # PDF
     PDF_PAGE_SIZE: str = "A4"
@@ -43,12 +62,16 @@ class Settings(BaseSettings):
     # FFmpeg
     FFMPEG_THREADS: int = 2
     FFMPEG_PRESET: str = "medium"  # ultrafast, fast, medium, slow
+    FFMPEG_COPY_JOBS: int = 16  # Concurrent stream-copy jobs (trim, merge, audio, probe)
+    FFMPEG_ENCODE_JOBS: int = 0  # Concurrent re-encodes (0 = available CPUs / threads per job)
+    FFMPEG_HWACCEL: str = "auto"  # auto (use NVENC if it works), nvenc, none
     
-    class Config:
-        case_sensitive = True
+    # Diagnostics
+    PROFILING_ENABLED: bool = False  # Allow ?profile=1 (needs pyinstrument)
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Process-wide settings instance (usable as a FastAPI dependency)"""
+    return Settings()
 
-# Ensure directories exist
-for directory in [settings.UPLOAD_DIR, settings.OUTPUT_DIR, settings.TEMP_DIR]:
-    directory.mkdir(parents=True, exist_ok=True)
+settings = get_settings()
@@ -0,0 +1,30 @@
+"""
+FastAPI dependencies for service instances
+Services are created once in the app lifespan and stored on app.state
+"""
+import httpx
+from fastapi import Request
+from app.services.crawler import CrawlerService
+from app.services.ocr_service import OCRService
+from app.services.pdf_service import PDFService
+from app.services.ffmpeg_service import FFmpegService
+
+def get_ocr(request: Request) -> OCRService:
+    """OCR service for the running app"""
+    return request.app.state.ocr
+
+def get_crawler(request: Request) -> CrawlerService:
+    """Crawler service for the running app"""
+    return request.app.state.crawler
+
+def get_pdf(request: Request) -> PDFService:
+    """PDF service for the running app"""
+    return request.app.state.pdf
+
+def get_ffmpeg(request: Request) -> FFmpegService:
+    """FFmpeg service for the running app"""
+    return request.app.state.ffmpeg
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Shared outbound HTTP client (pooled, keep-alive)"""
+    return request.app.state.http
@@ -3,32 +3,100 @@ Main FastAPI application
 All-in-One API Service - Production Ready
 """
 from fastapi import FastAPI, Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from contextlib import asynccontextmanager
-import time
+import asyncio
+import httpx
+import logging
+import logging.config
+import logging.handlers
+import queue
+import psutil
 
 from app.config import settings
+from app.middleware import AdmissionMiddleware, FastCORSTimingMiddleware
 from app.routers import crawl, ocr, pdf, ffmpeg, health
+from app.services.crawler import CrawlerService
+from app.services.ocr_service import OCRService
+from app.services.pdf_service import PDFService
+from app.services.ffmpeg_service import FFmpegService
+
+# Log records go onto a queue; a listener thread does the actual I/O
+log_queue = queue.SimpleQueue()
+logging.config.dictConfig({
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "queue": {
+            "()": logging.handlers.QueueHandler,
+            "queue": log_queue,
+        },
+    },
+    "loggers": {
+        "picolink": {"handlers": ["queue"], "level": "INFO", "propagate": False},
+    },
+})
+logger = logging.getLogger("picolink")
+
+def _start_log_listener() -> logging.handlers.QueueListener:
+    """Drain the log queue to stderr and a rotating file in a background thread"""
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    file_handler = logging.handlers.RotatingFileHandler(
+        settings.STORAGE_DIR / "app.log",
+        maxBytes=10 * 1024 * 1024,
+        backupCount=3
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    return listener
+
+async def _sample_cpu(app: FastAPI):
+    """
+    Sample CPU usage every 5s into app.state.cpu_percent
+    This is the only caller of psutil.cpu_percent, so each reading covers a full window
+    """
+    psutil.cpu_percent(interval=None)  # Start the first window
+    while True:
+        await asyncio.sleep(5)
+        app.state.cpu_percent = psutil.cpu_percent(interval=None)
 
 # Lifespan context manager for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("=" * 60)
-    print("🚀 All-in-One API Service Starting")
-    print("=" * 60)
-    print(f"📍 Storage: {settings.STORAGE_DIR}")
-    print(f"⚙️  Max upload: {settings.MAX_UPLOAD_SIZE}MB")
-    print(f"🧹 Cleanup: Every {settings.CLEANUP_HOURS} hours")
-    print("=" * 60)
+    for directory in (settings.UPLOAD_DIR, settings.OUTPUT_DIR, settings.TEMP_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+    app.state.log_listener = _start_log_listener()
+    
+    app.state.ocr = OCRService()
+    app.state.crawler = CrawlerService()
+    app.state.pdf = PDFService()
+    app.state.ffmpeg = FFmpegService()
+    app.state.http = httpx.AsyncClient(
+        timeout=30,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+    )
+    app.state.cpu_percent = 0.0
+    app.state.cpu_task = asyncio.create_task(_sample_cpu(app))
+    
+    logger.info("🚀 All-in-One API Service Starting")
+    logger.info(f"📍 Storage: {settings.STORAGE_DIR}")
+    logger.info(f"⚙️  Max upload: {settings.MAX_UPLOAD_SIZE}MB")
+    logger.info(f"🧹 Cleanup: Every {settings.CLEANUP_HOURS} hours")
     
     yield
     
     # Shutdown
-    print("=" * 60)
-    print("👋 All-in-One API Service Shutting Down")
-    print("=" * 60)
+    app.state.cpu_task.cancel()
+    await app.state.crawler.aclose()
+    await app.state.http.aclose()
+    
+    logger.info("👋 All-in-One API Service Shutting Down")
+    app.state.log_listener.stop()
 
 # Create FastAPI app
 app = FastAPI(
@@ -77,32 +145,40 @@ app = FastAPI(
     """.format(settings.MAX_CONCURRENT_REQUESTS),
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc"
 )
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Concurrency cap; added first so it sits inside CORS and 503s still get CORS headers
+app.add_middleware(AdmissionMiddleware, limit=settings.MAX_CONCURRENT_REQUESTS)
 
-# Request timing middleware
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# CORS + request timing in one ASGI middleware
+app.add_middleware(FastCORSTimingMiddleware)
+
+# Opt-in profiling: ?profile=1 returns a Pyinstrument call graph
+if settings.PROFILING_ENABLED:
+    from pyinstrument import Profiler
+    
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if not request.query_params.get("profile"):
+            return await call_next(request)
+        
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        response = await call_next(request)
+        # Drain the body so streamed work is included in the profile
+        async for _ in response.body_iterator:
+            pass
+        profiler.stop()
+        return HTMLResponse(profiler.output_html())
 
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    return JSONResponse(
+    logger.exception("unhandled", exc_info=exc)
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal server error",
@@ -0,0 +1,110 @@
+"""
+Pure ASGI middleware
+Avoids per-request BaseHTTPMiddleware overhead on the hot path
+"""
+import asyncio
+import time
+
+# Methods advertised on CORS preflight (same set Starlette uses for "*")
+CORS_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+class FastCORSTimingMiddleware:
+    """
+    Permissive CORS (any origin, method, header, with credentials)
+    plus an X-Process-Time header, in a single middleware hop
+    """
+    
+    def __init__(self, app, max_age: int = 600):
+        self.app = app
+        # Built once; only the echoed origin/headers vary per request
+        self._preflight_headers = [
+            (b"access-control-allow-methods", CORS_METHODS),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", str(max_age).encode()),
+            (b"vary", b"Origin"),
+            (b"content-length", b"0"),
+        ]
+        self._simple_headers = [
+            (b"access-control-allow-credentials", b"true"),
+        ]
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope["headers"])
+        origin = headers.get(b"origin")
+        
+        # Answer CORS preflight directly without touching the app
+        if (
+            scope["method"] == "OPTIONS"
+            and origin is not None
+            and b"access-control-request-method" in headers
+        ):
+            response_headers = [(b"access-control-allow-origin", origin)]
+            requested = headers.get(b"access-control-request-headers")
+            if requested:
+                response_headers.append((b"access-control-allow-headers", requested))
+            await send({
+                "type": "http.response.start",
+                "status": 204,
+                "headers": response_headers + self._preflight_headers,
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        start_time = time.perf_counter()
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                extra = [(b"x-process-time", str(time.perf_counter() - start_time).encode())]
+                if origin is not None:
+                    # Credentialed requests need the explicit origin, not "*"
+                    if b"cookie" in headers:
+                        extra.append((b"access-control-allow-origin", origin))
+                        extra.append((b"vary", b"Origin"))
+                    else:
+                        extra.append((b"access-control-allow-origin", b"*"))
+                    extra.extend(self._simple_headers)
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+        
+        await self.app(scope, receive, send_wrapper)
+
+class AdmissionMiddleware:
+    """
+    Caps in-flight requests at `limit`, answering 503 once saturated
+    instead of letting work queue up unbounded
+    """
+    
+    # Cheap endpoints that should answer even under load
+    BYPASS_PATHS = frozenset({"/", "/health"})
+    
+    def __init__(self, app, limit: int):
+        self.app = app
+        self.sem = asyncio.Semaphore(limit)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.BYPASS_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        # Reject rather than wait when every slot is taken
+        if self.sem.locked():
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({
+                "type": "http.response.body",
+                "body": b'{"detail":"Server busy, retry shortly"}',
+            })
+            return
+        
+        async with self.sem:
+            await self.app(scope, receive, send)
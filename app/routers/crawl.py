@@ -1,11 +1,12 @@
 """
 Crawl4AI router - Web scraping endpoints
 """
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, HttpUrl
-from typing import Optional
-from app.services.crawler import crawler_service
-from app.utils import validate_url
+from app.concurrency import CRAWL_SEMAPHORE
+from app.dependencies import get_crawler
+from app.services.crawler import CrawlerService
+from app.utils import validate_url_obj
 
 router = APIRouter(prefix="/crawl", tags=["Web Scraping"])
 
@@ -18,7 +19,10 @@ class DeepScrapeRequest(BaseModel):
     same_domain_only: bool = True
 
 @router.post("/scrape")
-async def scrape_simple(request: ScrapeRequest):
+async def scrape_simple(
+    request: ScrapeRequest,
+    crawler_service: CrawlerService = Depends(get_crawler)
+):
     """
     Simple web scrape - returns cleaned text
     
@@ -38,10 +42,11 @@ async def scrape_simple(request: ScrapeRequest):
     }
     ```
     """
-    if not validate_url(str(request.url)):
+    if not validate_url_obj(request.url):
         raise HTTPException(status_code=400, detail="Invalid URL")
     
-    result = await crawler_service.scrape_simple(str(request.url))
+    async with CRAWL_SEMAPHORE:
+        result = await crawler_service.scrape_simple(str(request.url))
     
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
@@ -49,7 +54,10 @@ async def scrape_simple(request: ScrapeRequest):
     return result
 
 @router.post("/scrape/html")
-async def scrape_html(request: ScrapeRequest):
+async def scrape_html(
+    request: ScrapeRequest,
+    crawler_service: CrawlerService = Depends(get_crawler)
+):
     """
     Fetch raw HTML from URL
     
@@ -69,10 +77,11 @@ async def scrape_html(request: ScrapeRequest):
     }
     ```
     """
-    if not validate_url(str(request.url)):
+    if not validate_url_obj(request.url):
         raise HTTPException(status_code=400, detail="Invalid URL")
     
-    result = await crawler_service.scrape_html(str(request.url))
+    async with CRAWL_SEMAPHORE:
+        result = await crawler_service.scrape_html(str(request.url))
     
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
@@ -80,7 +89,10 @@ async def scrape_html(request: ScrapeRequest):
     return result
 
 @router.post("/scrape/text")
-async def scrape_text(request: ScrapeRequest):
+async def scrape_text(
+    request: ScrapeRequest,
+    crawler_service: CrawlerService = Depends(get_crawler)
+):
     """
     Fetch plain text only (no HTML)
     
@@ -89,10 +101,11 @@ async def scrape_text(request: ScrapeRequest):
     - Feed into text analysis
     - Simple content retrieval
     """
-    if not validate_url(str(request.url)):
+    if not validate_url_obj(request.url):
         raise HTTPException(status_code=400, detail="Invalid URL")
     
-    result = await crawler_service.scrape_text(str(request.url))
+    async with CRAWL_SEMAPHORE:
+        result = await crawler_service.scrape_text(str(request.url))
     
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
@@ -100,7 +113,10 @@ async def scrape_text(request: ScrapeRequest):
     return result
 
 @router.post("/scrape/meta")
-async def scrape_metadata(request: ScrapeRequest):
+async def scrape_metadata(
+    request: ScrapeRequest,
+    crawler_service: CrawlerService = Depends(get_crawler)
+):
     """
     Extract page metadata and links
     
@@ -115,10 +131,11 @@ async def scrape_metadata(request: ScrapeRequest):
     - Link discovery
     - Social media preview data
     """
-    if not validate_url(str(request.url)):
+    if not validate_url_obj(request.url):
         raise HTTPException(status_code=400, detail="Invalid URL")
     
-    result = await crawler_service.scrape_metadata(str(request.url))
+    async with CRAWL_SEMAPHORE:
+        result = await crawler_service.scrape_metadata(str(request.url))
     
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
@@ -126,7 +143,10 @@ async def scrape_metadata(request: ScrapeRequest):
     return result
 
 @router.post("/scrape/deep")
-async def scrape_deep(request: DeepScrapeRequest):
+async def scrape_deep(
+    request: DeepScrapeRequest,
+    crawler_service: CrawlerService = Depends(get_crawler)
+):
     """
     Deep crawl - multiple pages
     
@@ -154,13 +174,14 @@ async def scrape_deep(request: DeepScrapeRequest):
     }
     ```
     """
-    if not validate_url(str(request.url)):
+    if not validate_url_obj(request.url):
         raise HTTPException(status_code=400, detail="Invalid URL")
     
-    result = await crawler_service.scrape_deep(
-        str(request.url),
-        request.max_pages,
-        request.same_domain_only
-    )
+    async with CRAWL_SEMAPHORE:
+        result = await crawler_service.scrape_deep(
+            str(request.url),
+            request.max_pages,
+            request.same_domain_only
+        )
     
     return result
@@ -2,16 +2,44 @@
 FFmpeg router - Video/audio processing endpoints
 NO AI features (transcription/captioning removed)
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+import os
+import json
+import math
+from pathlib import Path
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import List, Optional
-from app.services.ffmpeg_service import ffmpeg_service
-from app.utils import save_upload_file, cleanup_file, VIDEO_TYPES, AUDIO_TYPES
+from app.concurrency import FFMPEG_SEMAPHORE
+from app.dependencies import get_ffmpeg
+from app.services.ffmpeg_service import FFmpegService, THUMBNAIL_CODECS
+from app.utils import save_upload_file, save_upload_files, cleanup_file, require_mime, stream_and_delete, VIDEO_TYPES, AUDIO_TYPES
 
 router = APIRouter(prefix="/ffmpeg", tags=["Video/Audio Processing"])
 
+def _stream_output(
+    output_path: Path,
+    stat_result: os.stat_result,
+    media_type: str,
+    filename: str,
+    background: BackgroundTasks
+) -> StreamingResponse:
+    """Stream an FFmpeg output in 1 MiB chunks and delete it once sent"""
+    return StreamingResponse(
+        stream_and_delete(output_path),
+        media_type=media_type,
+        headers={
+            "Content-Length": str(stat_result.st_size),
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        },
+        background=background
+    )
+
 @router.post("/info")
-async def get_media_info(file: UploadFile = File(...)):
+async def get_media_info(
+    background: BackgroundTasks,
+    file: UploadFile = File(...),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
+):
     """
     Get detailed media information
     
@@ -36,25 +64,32 @@ async def get_media_info(file: UploadFile = File(...)):
     }
     ```
     """
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES | AUDIO_TYPES)
+    require_mime(file, VIDEO_TYPES | AUDIO_TYPES)
     
-    try:
-        result = ffmpeg_service.get_media_info(file_path)
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES | AUDIO_TYPES)
+        
+        try:
+            result = await ffmpeg_service.get_media_info(file_path)
+            
+            if not result["success"]:
+                raise HTTPException(status_code=500, detail=result["error"])
         
-        if not result["success"]:
-            raise HTTPException(status_code=500, detail=result["error"])
+        except:
+            cleanup_file(file_path)
+            raise
         
+        background.add_task(cleanup_file, file_path)
         return result
-    
-    finally:
-        cleanup_file(file_path)
 
 @router.post("/trim")
 async def trim_video(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     start_time: float = Form(...),
     end_time: Optional[float] = Form(None),
-    duration: Optional[float] = Form(None)
+    duration: Optional[float] = Form(None),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Trim video to specific timeframe
@@ -101,30 +136,129 @@ async def trim_video(
             detail="Provide only end_time OR duration, not both"
         )
     
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+    require_mime(file, VIDEO_TYPES)
     
-    try:
-        success, output_path, message = ffmpeg_service.trim_video(
-            file_path,
-            start_time,
-            end_time,
-            duration
-        )
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.trim_video(
+                file_path,
+                start_time,
+                end_time,
+                duration
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        return FileResponse(
-            path=output_path,
+        except:
+            cleanup_file(file_path)
+            raise
+        
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type="video/mp4",
-            filename=f"trimmed_{output_path.name}"
+            filename=f"trimmed_{output_path.name}",
+            background=background
+        )
+
+@router.post("/trim-batch")
+async def trim_video_batch(
+    background: BackgroundTasks,
+    file: UploadFile = File(...),
+    segments: str = Form(...),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
+):
+    """
+    Cut several clips from one video in a single pass
+    
+    **Parameters:**
+    - file: Video file
+    - segments: JSON list of [start, end] pairs in seconds, e.g. `[[0, 5], [30, 42.5]]`
+    
+    **Returns:** ZIP with clip_01.mp4, clip_02.mp4, ... in the given order
+    
+    **Use cases:**
+    - Highlight reels
+    - Splitting a recording into chapters
+    
+    **Speed:** Very fast (no re-encoding, source is read once)
+    
+    **Limits:**
+    - Max 20 segments per request
+    
+    **n8n example:**
+    ```json
+    {
+      "method": "POST",
+      "url": "https://your-service.koyeb.app/ffmpeg/trim-batch",
+      "body": {
+        "file": "@video.mp4",
+        "segments": "[[0, 5], [30, 42.5]]"
+      }
+    }
+    ```
+    """
+    try:
+        parsed = [(float(start), float(end)) for start, end in json.loads(segments)]
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=400,
+            detail="segments must be a JSON list of [start, end] pairs"
         )
     
-    finally:
-        cleanup_file(file_path)
+    if not parsed or len(parsed) > 20:
+        raise HTTPException(
+            status_code=400,
+            detail="Provide between 1 and 20 segments"
+        )
+    
+    # NaN/Infinity parse as floats and slip past the ordering check
+    if any(
+        not (math.isfinite(start) and math.isfinite(end)) or start < 0 or end <= start
+        for start, end in parsed
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="Each segment needs finite 0 <= start < end"
+        )
+    
+    require_mime(file, VIDEO_TYPES)
+    
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+        
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.trim_video_batch(
+                file_path,
+                parsed
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
+        
+        except:
+            cleanup_file(file_path)
+            raise
+        
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
+            media_type="application/zip",
+            filename=f"clips_{output_path.name}",
+            background=background
+        )
 
 @router.post("/merge")
-async def merge_videos(files: List[UploadFile] = File(...)):
+async def merge_videos(
+    background: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
+):
     """
     Merge multiple videos into one
     
@@ -154,34 +288,46 @@ async def merge_videos(files: List[UploadFile] = File(...)):
             detail="Too many files. Max 20 videos per request"
         )
     
-    saved_paths = []
+    for file in files:
+        require_mime(file, VIDEO_TYPES)
     
-    try:
-        for file in files:
-            file_path, mime = await save_upload_file(file, VIDEO_TYPES)
-            saved_paths.append(file_path)
+    async with FFMPEG_SEMAPHORE:
+        saved_paths = []
         
-        success, output_path, message = ffmpeg_service.merge_videos(saved_paths)
+        try:
+            saved = await save_upload_files(files, VIDEO_TYPES)
+            saved_paths = [file_path for file_path, mime in saved]
+            
+            success, output_path, stat_result, message = await ffmpeg_service.merge_videos(
+                saved_paths
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        except:
+            for path in saved_paths:
+                cleanup_file(path)
+            raise
         
-        return FileResponse(
-            path=output_path,
+        for path in saved_paths:
+            background.add_task(cleanup_file, path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type="video/mp4",
-            filename=f"merged_{output_path.name}"
+            filename=f"merged_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        for path in saved_paths:
-            cleanup_file(path)
 
 @router.post("/resize")
 async def resize_video(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     width: int = Form(...),
     height: int = Form(...),
-    maintain_aspect: bool = Form(True)
+    maintain_aspect: bool = Form(True),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Resize video to specific dimensions
@@ -216,33 +362,42 @@ async def resize_video(
     }
     ```
     """
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+    require_mime(file, VIDEO_TYPES)
     
-    try:
-        success, output_path, message = ffmpeg_service.resize_video(
-            file_path,
-            width,
-            height,
-            maintain_aspect
-        )
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.resize_video(
+                file_path,
+                width,
+                height,
+                maintain_aspect
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        return FileResponse(
-            path=output_path,
+        except:
+            cleanup_file(file_path)
+            raise
+        
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type="video/mp4",
-            filename=f"resized_{output_path.name}"
+            filename=f"resized_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        cleanup_file(file_path)
 
 @router.post("/compress")
 async def compress_video(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     crf: int = Form(23),
-    max_bitrate: Optional[str] = Form(None)
+    max_bitrate: Optional[str] = Form(None),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Compress video to reduce file size
@@ -282,32 +437,41 @@ async def compress_video(
             detail="CRF must be between 0 and 51"
         )
     
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+    require_mime(file, VIDEO_TYPES)
     
-    try:
-        success, output_path, message = ffmpeg_service.compress_video(
-            file_path,
-            crf,
-            max_bitrate
-        )
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.compress_video(
+                file_path,
+                crf,
+                max_bitrate
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        return FileResponse(
-            path=output_path,
+        except:
+            cleanup_file(file_path)
+            raise
+        
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type="video/mp4",
-            filename=f"compressed_{output_path.name}"
+            filename=f"compressed_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        cleanup_file(file_path)
 
 @router.post("/extract-audio")
 async def extract_audio(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     format: str = Form("mp3"),
-    bitrate: str = Form("192k")
+    bitrate: str = Form("192k"),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Extract audio from video
@@ -340,38 +504,48 @@ async def extract_audio(
             detail="Invalid format. Use: mp3, wav, or ogg"
         )
     
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+    require_mime(file, VIDEO_TYPES)
     
-    try:
-        success, output_path, message = ffmpeg_service.extract_audio(
-            file_path,
-            format,
-            bitrate
-        )
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.extract_audio(
+                file_path,
+                format,
+                bitrate
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
+            
+            audio_mime = {
+                "mp3": "audio/mpeg",
+                "wav": "audio/wav",
+                "ogg": "audio/ogg"
+            }[format]
         
-        audio_mime = {
-            "mp3": "audio/mpeg",
-            "wav": "audio/wav",
-            "ogg": "audio/ogg"
-        }[format]
+        except:
+            cleanup_file(file_path)
+            raise
         
-        return FileResponse(
-            path=output_path,
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type=audio_mime,
-            filename=f"audio_{output_path.name}"
+            filename=f"audio_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        cleanup_file(file_path)
 
 @router.post("/thumbnail")
 async def generate_thumbnail(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     timestamp: float = Form(1.0),
-    width: int = Form(640)
+    width: int = Form(640),
+    format: str = Form("webp"),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Generate thumbnail image from video
@@ -379,6 +553,7 @@ async def generate_thumbnail(
     **Parameters:**
     - timestamp: Time to capture (seconds)
     - width: Thumbnail width (height auto-scaled)
+    - format: webp (default) or jpg
     
     **Use cases:**
     - Video previews
@@ -398,32 +573,49 @@ async def generate_thumbnail(
     }
     ```
     """
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
-    
-    try:
-        success, output_path, message = ffmpeg_service.generate_thumbnail(
-            file_path,
-            timestamp,
-            width
+    if format not in THUMBNAIL_CODECS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported thumbnail format. Allowed: {', '.join(THUMBNAIL_CODECS)}"
         )
+    
+    require_mime(file, VIDEO_TYPES)
+    
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+        
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.generate_thumbnail(
+                file_path,
+                timestamp,
+                width,
+                format
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        except:
+            cleanup_file(file_path)
+            raise
         
+        background.add_task(cleanup_file, file_path)
+        background.add_task(cleanup_file, output_path)
         return FileResponse(
             path=output_path,
-            media_type="image/jpeg",
-            filename=f"thumb_{output_path.name}"
+            stat_result=stat_result,
+            media_type="image/webp" if format == "webp" else "image/jpeg",
+            filename=f"thumb_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        cleanup_file(file_path)
 
 @router.post("/convert")
 async def convert_format(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     output_format: str = Form(...),
-    codec: Optional[str] = Form(None)
+    codec: Optional[str] = Form(None),
+    ffmpeg_service: FFmpegService = Depends(get_ffmpeg)
 ):
     """
     Convert video to different format
@@ -461,23 +653,31 @@ async def convert_format(
             detail=f"Invalid format. Use: {', '.join(valid_formats)}"
         )
     
-    file_path, mime = await save_upload_file(file, VIDEO_TYPES)
+    require_mime(file, VIDEO_TYPES)
     
-    try:
-        success, output_path, message = ffmpeg_service.convert_format(
-            file_path,
-            output_format,
-            codec
-        )
+    async with FFMPEG_SEMAPHORE:
+        file_path, mime = await save_upload_file(file, VIDEO_TYPES)
         
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
+        try:
+            success, output_path, stat_result, message = await ffmpeg_service.convert_format(
+                file_path,
+                output_format,
+                codec
+            )
+            
+            if not success:
+                raise HTTPException(status_code=500, detail=message)
         
-        return FileResponse(
-            path=output_path,
+        except:
+            cleanup_file(file_path)
+            raise
+        
+        background.add_task(cleanup_file, file_path)
+        return _stream_output(
+            output_path,
+            stat_result,
             media_type=f"video/{output_format}",
-            filename=f"converted_{output_path.name}"
+            filename=f"converted_{output_path.name}",
+            background=background
         )
-    
-    finally:
-        cleanup_file(file_path)
+
@@ -1,14 +1,44 @@
 """
 Health check and system info endpoints
 """
+import asyncio
 import subprocess
 import psutil
-from fastapi import APIRouter
-from app.config import settings
-from app.services.ocr_service import ocr_service
+from functools import lru_cache
+from fastapi import APIRouter, Depends, Request
+from app.config import Settings, get_settings
+from app.dependencies import get_crawler, get_ocr
+from app.services.crawler import CrawlerService
+from app.services.ocr_service import OCRService
 
 router = APIRouter(tags=["System"])
 
+@lru_cache(maxsize=1)
+def _ffmpeg_version() -> str:
+    """FFmpeg version string (probed once per process)"""
+    try:
+        ffmpeg_result = subprocess.run(
+            ['ffmpeg', '-version'],
+            capture_output=True,
+            text=True
+        )
+        return ffmpeg_result.stdout.split('\n')[0]
+    except:
+        return "Not available"
+
+@lru_cache(maxsize=1)
+def _tess_version() -> str:
+    """Tesseract version string (probed once per process)"""
+    try:
+        tess_result = subprocess.run(
+            ['tesseract', '--version'],
+            capture_output=True,
+            text=True
+        )
+        return tess_result.stdout.split('\n')[0]
+    except:
+        return "Not available"
+
 @router.get("/health")
 async def health_check():
     """
@@ -23,7 +53,12 @@ async def health_check():
     }
 
 @router.get("/info")
-async def system_info():
+async def system_info(
+    request: Request,
+    ocr_service: OCRService = Depends(get_ocr),
+    crawler: CrawlerService = Depends(get_crawler),
+    settings: Settings = Depends(get_settings)
+):
     """
     Get system information and capabilities
     
@@ -33,31 +68,16 @@ async def system_info():
     - Available features
     - Configuration
     """
-    # Get FFmpeg version
-    try:
-        ffmpeg_result = subprocess.run(
-            ['ffmpeg', '-version'],
-            capture_output=True,
-            text=True
-        )
-        ffmpeg_version = ffmpeg_result.stdout.split('\n')[0]
-    except:
-        ffmpeg_version = "Not available"
-    
-    # Get Tesseract version
-    try:
-        tess_result = subprocess.run(
-            ['tesseract', '--version'],
-            capture_output=True,
-            text=True
-        )
-        tess_version = tess_result.stdout.split('\n')[0]
-    except:
-        tess_version = "Not available"
-    
-    # Get system resources
+    # Get system resources (CPU comes from the lifespan's periodic sample)
     memory = psutil.virtual_memory()
-    cpu_percent = psutil.cpu_percent(interval=1)
+    cpu_percent = request.app.state.cpu_percent
+    
+    # Version probes and the language list may spawn processes; run them in threads
+    tess_version, ffmpeg_version, ocr_languages = await asyncio.gather(
+        asyncio.to_thread(_tess_version),
+        asyncio.to_thread(_ffmpeg_version),
+        asyncio.to_thread(ocr_service.get_available_languages)
+    )
     
     return {
         "service": "All-in-One API Service",
@@ -79,7 +99,8 @@ async def system_info():
             "cpu_usage_percent": cpu_percent,
             "memory_total_mb": memory.total / (1024**2),
             "memory_available_mb": memory.available / (1024**2),
-            "memory_used_percent": memory.percent
+            "memory_used_percent": memory.percent,
+            "crawler_connections": crawler.connection_stats()
         },
         "configuration": {
             "max_upload_size_mb": settings.MAX_UPLOAD_SIZE,
@@ -87,7 +108,7 @@ async def system_info():
             "max_pdf_pages": settings.MAX_PDF_PAGES,
             "cleanup_hours": settings.CLEANUP_HOURS
         },
-        "ocr_languages": ocr_service.get_available_languages()
+        "ocr_languages": ocr_languages
     }
 
 @router.get("/")
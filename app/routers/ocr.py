@@ -1,18 +1,22 @@
 """
 OCR router - Text extraction from images and PDFs
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+import asyncio
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
 from typing import Optional, List
-from app.services.ocr_service import ocr_service
-from app.utils import save_upload_file, cleanup_file, IMAGE_TYPES, PDF_TYPES
+from app.dependencies import get_ocr
+from app.services.ocr_service import OCRService
+from app.utils import save_upload_file, cleanup_file, require_mime, IMAGE_TYPES, PDF_TYPES
 
 router = APIRouter(prefix="/ocr", tags=["OCR"])
 
 @router.post("/image")
 async def ocr_image(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     language: Optional[str] = Form("eng"),
-    output_format: str = Form("text")
+    output_format: str = Form("text"),
+    ocr_service: OCRService = Depends(get_ocr)
 ):
     """
     Extract text from image
@@ -54,12 +58,24 @@ async def ocr_image(
             detail="Invalid output_format. Use: text, hocr, or json"
         )
     
+    # Check the language before any upload or Tesseract work
+    # (usually cached; a refresh spawns tesseract, so keep it off the event loop)
+    unknown = await asyncio.to_thread(ocr_service.unknown_languages, language)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Language not installed: {', '.join(unknown)}. See /ocr/languages"
+        )
+    
+    require_mime(file, IMAGE_TYPES)
+    
     # Save uploaded file
     file_path, mime = await save_upload_file(file, IMAGE_TYPES)
     
     try:
-        # Extract text
-        result = ocr_service.extract_text_from_image(
+        # Extract text (Tesseract blocks, so run it off the event loop)
+        result = await asyncio.to_thread(
+            ocr_service.extract_text_from_image,
             file_path,
             lang=language,
             output_format=output_format
@@ -67,19 +83,23 @@ async def ocr_image(
         
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
-        
-        return result
     
-    finally:
-        # Cleanup
+    except:
         cleanup_file(file_path)
+        raise
+    
+    # Cleanup after the response is sent
+    background.add_task(cleanup_file, file_path)
+    return result
 
 @router.post("/pdf")
 async def ocr_pdf(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     language: Optional[str] = Form("eng"),
     pages: Optional[str] = Form(None),
-    output_format: str = Form("text")
+    output_format: str = Form("text"),
+    ocr_service: OCRService = Depends(get_ocr)
 ):
     """
     Extract text from PDF pages
@@ -131,23 +151,40 @@ async def ocr_pdf(
             detail="Invalid output_format. Use: text, hocr, or json"
         )
     
+    # Check the language before any upload or Tesseract work
+    # (usually cached; a refresh spawns tesseract, so keep it off the event loop)
+    unknown = await asyncio.to_thread(ocr_service.unknown_languages, language)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Language not installed: {', '.join(unknown)}. See /ocr/languages"
+        )
+    
     # Parse page numbers
     page_list = None
     if pages:
         try:
-            page_list = [int(p.strip()) for p in pages.split(",")]
+            page_list = frozenset(int(p) for p in pages.split(",") if p.strip())
         except ValueError:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid pages format. Use comma-separated numbers: 1,2,3"
             )
+        if any(p < 1 for p in page_list):
+            raise HTTPException(
+                status_code=400,
+                detail="Page numbers start at 1"
+            )
+    
+    require_mime(file, PDF_TYPES)
     
     # Save uploaded file
     file_path, mime = await save_upload_file(file, PDF_TYPES)
     
     try:
-        # Extract text
-        result = ocr_service.extract_text_from_pdf(
+        # Extract text (Tesseract blocks, so run it off the event loop)
+        result = await asyncio.to_thread(
+            ocr_service.extract_text_from_pdf,
             file_path,
             lang=language,
             pages=page_list,
@@ -156,15 +193,17 @@ async def ocr_pdf(
         
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
-        
-        return result
     
-    finally:
-        # Cleanup
+    except:
         cleanup_file(file_path)
+        raise
+    
+    # Cleanup after the response is sent
+    background.add_task(cleanup_file, file_path)
+    return result
 
 @router.get("/languages")
-async def get_languages():
+async def get_languages(ocr_service: OCRService = Depends(get_ocr)):
     """
     Get list of available OCR languages
     
@@ -178,6 +217,7 @@ async def get_languages():
     - ara: Arabic
     - chi_sim: Chinese Simplified
     """
+    # A cache refresh spawns tesseract, so keep it off the event loop
     return {
-        "languages": ocr_service.get_available_languages()
+        "languages": await asyncio.to_thread(ocr_service.get_available_languages)
     }
@@ -2,103 +2,154 @@
 PDF generation router - Create PDFs from various sources
 JSON body, A4 default for all PDFs
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
 from fastapi.responses import FileResponse
-from typing import List, Optional
-from pydantic import BaseModel, HttpUrl
-import base64
-import requests
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, HttpUrl
+import asyncio
+import io
+import os
+import tempfile
+import pybase64
+import aiofiles
+import httpx
 from pathlib import Path
-from app.services.pdf_service import pdf_service
-from app.utils import save_upload_file, cleanup_file, IMAGE_TYPES, PDF_TYPES, generate_filename
-from app.config import settings
+from app.concurrency import PDF_SEMAPHORE, run_pdf
+from app.dependencies import get_http_client, get_pdf
+from app.services.pdf_service import PDFService
+from app.utils import save_upload_files, cleanup_dir, cleanup_file, IMAGE_TYPES, PDF_TYPES, UPLOAD_CHUNK_SIZE, generate_filename
+from app.config import Settings, get_settings
 
 router = APIRouter(prefix="/pdf", tags=["PDF Generation"])
 
 class TextToPDFRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     text: str
     title: Optional[str] = None
     style: str = "default"
     page_size: str = "A4"  # Default A4
 
 class HTMLToPDFRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     html: str
     page_size: str = "A4"  # Default A4
     css: Optional[str] = None
 
 class MarkdownToPDFRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     markdown: str
     page_size: str = "A4"  # Default A4
     style: str = "default"
 
 class MergePDFsFromURLRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     urls: List[HttpUrl]
 
 class MergePDFsFromBase64Request(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     pdfs: List[str]
 
+async def _render_pdf(func, *args, **kwargs) -> Tuple[Path, os.stat_result]:
+    """Run a PDF service call in the PDF pool and stat the result there too"""
+    def job():
+        pdf_path = func(*args, **kwargs)
+        return pdf_path, pdf_path.stat()
+    return await run_pdf(job)
+
 @router.post("/from-text")
-async def create_pdf_from_text(request: TextToPDFRequest):
+async def create_pdf_from_text(
+    background: BackgroundTasks,
+    request: TextToPDFRequest,
+    pdf_service: PDFService = Depends(get_pdf)
+):
     """Create PDF from plain text (A4 default)"""
     try:
-        pdf_path = pdf_service.create_from_text(
-            request.text,
-            style=request.style,
-            page_size=request.page_size,
-            title=request.title
-        )
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(
+                pdf_service.create_from_text,
+                request.text,
+                style=request.style,
+                page_size=request.page_size,
+                title=request.title
+            )
         
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=document_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/from-html")
-async def create_pdf_from_html(request: HTMLToPDFRequest):
+async def create_pdf_from_html(
+    background: BackgroundTasks,
+    request: HTMLToPDFRequest,
+    pdf_service: PDFService = Depends(get_pdf)
+):
     """Create PDF from HTML (A4 default, reliable extraction)"""
     try:
-        pdf_path = pdf_service.create_from_html(
-            request.html,
-            page_size=request.page_size,
-            css=request.css
-        )
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(
+                pdf_service.create_from_html,
+                request.html,
+                page_size=request.page_size,
+                css=request.css
+            )
         
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=document_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/from-markdown")
-async def create_pdf_from_markdown(request: MarkdownToPDFRequest):
+async def create_pdf_from_markdown(
+    background: BackgroundTasks,
+    request: MarkdownToPDFRequest,
+    pdf_service: PDFService = Depends(get_pdf)
+):
     """Create PDF from Markdown (A4 default)"""
     try:
-        pdf_path = pdf_service.create_from_markdown(
-            request.markdown,
-            page_size=request.page_size,
-            style=request.style
-        )
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(
+                pdf_service.create_from_markdown,
+                request.markdown,
+                page_size=request.page_size,
+                style=request.style
+            )
         
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=document_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except Exception as e:
@@ -106,9 +157,12 @@ async def create_pdf_from_markdown(request: MarkdownToPDFRequest):
 
 @router.post("/from-images")
 async def create_pdf_from_images(
+    background: BackgroundTasks,
     files: List[UploadFile] = File(...),
     page_size: str = Form("A4"),  # Default A4
-    fit_to_page: bool = Form(True)
+    fit_to_page: bool = Form(True),
+    pdf_service: PDFService = Depends(get_pdf),
+    settings: Settings = Depends(get_settings)
 ):
     """Create PDF from multiple images (A4 default)"""
     if len(files) > 100:
@@ -117,37 +171,44 @@ async def create_pdf_from_images(
             detail="Too many files. Max 100 images per request"
         )
     
-    saved_paths = []
+    req_dir = Path(tempfile.mkdtemp(dir=settings.UPLOAD_DIR))  # Removed in one go at the end
     
     try:
-        for file in files:
-            file_path, mime = await save_upload_file(file, IMAGE_TYPES)
-            saved_paths.append(file_path)
+        saved = await save_upload_files(files, IMAGE_TYPES, limit=16, dest_dir=req_dir)
+        saved_paths = [file_path for file_path, mime in saved]
         
-        pdf_path = pdf_service.create_from_images(
-            saved_paths,
-            page_size=page_size,
-            fit_to_page=fit_to_page
-        )
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(
+                pdf_service.create_from_images,
+                saved_paths,
+                page_size=page_size,
+                fit_to_page=fit_to_page
+            )
         
+        background.add_task(cleanup_dir, req_dir)
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=images_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except Exception as e:
+        cleanup_dir(req_dir)
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        for path in saved_paths:
-            cleanup_file(path)
 
 @router.post("/merge")
-async def merge_pdfs(files: List[UploadFile] = File(...)):
+async def merge_pdfs(
+    background: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    pdf_service: PDFService = Depends(get_pdf),
+    settings: Settings = Depends(get_settings)
+):
     """Merge multiple PDFs"""
     if len(files) > 50:
         raise HTTPException(
@@ -155,33 +216,40 @@ async def merge_pdfs(files: List[UploadFile] = File(...)):
             detail="Too many files. Max 50 PDFs per request"
         )
     
-    saved_paths = []
+    req_dir = Path(tempfile.mkdtemp(dir=settings.UPLOAD_DIR))  # Removed in one go at the end
     
     try:
-        for file in files:
-            file_path, mime = await save_upload_file(file, PDF_TYPES)
-            saved_paths.append(file_path)
+        saved = await save_upload_files(files, PDF_TYPES, limit=16, dest_dir=req_dir)
+        saved_paths = [file_path for file_path, mime in saved]
         
-        pdf_path = pdf_service.merge_pdfs(saved_paths)
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(pdf_service.merge_pdfs, saved_paths)
         
+        background.add_task(cleanup_dir, req_dir)
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=merged_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except Exception as e:
+        cleanup_dir(req_dir)
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        for path in saved_paths:
-            cleanup_file(path)
 
 @router.post("/merge-from-urls")
-async def merge_pdfs_from_urls(request: MergePDFsFromURLRequest):
+async def merge_pdfs_from_urls(
+    background: BackgroundTasks,
+    request: MergePDFsFromURLRequest,
+    pdf_service: PDFService = Depends(get_pdf),
+    client: httpx.AsyncClient = Depends(get_http_client),
+    settings: Settings = Depends(get_settings)
+):
     """Merge PDFs from URLs"""
     if len(request.urls) > 50:
         raise HTTPException(
@@ -190,53 +258,99 @@ async def merge_pdfs_from_urls(request: MergePDFsFromURLRequest):
         )
     
     saved_paths = []
+    req_dir = Path(tempfile.mkdtemp(dir=settings.UPLOAD_DIR))  # Removed in one go at the end
+    sem = asyncio.Semaphore(10)  # Bound sockets per request
+    max_file_bytes = settings.MAX_UPLOAD_SIZE * 1024 * 1024
+    max_total_bytes = settings.MAX_MERGE_DOWNLOAD_SIZE * 1024 * 1024
+    total_bytes = 0
     
-    try:
-        for url in request.urls:
+    async def fetch(url: HttpUrl) -> Path:
+        nonlocal total_bytes
+        temp_path = req_dir / generate_filename("pdf")
+        async with sem:
             try:
-                response = requests.get(str(url), timeout=30)
-                response.raise_for_status()
-                
-                content_type = response.headers.get('content-type', '')
-                if 'pdf' not in content_type.lower():
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"URL {url} does not return a PDF"
-                    )
-                
-                temp_path = settings.UPLOAD_DIR / generate_filename("pdf")
-                with open(temp_path, 'wb') as f:
-                    f.write(response.content)
-                
-                saved_paths.append(temp_path)
-            except requests.RequestException as e:
+                async with asyncio.timeout(30), client.stream("GET", str(url)) as response:
+                    response.raise_for_status()
+                    
+                    # Check the type and declared size before pulling the body
+                    content_type = response.headers.get('content-type', '')
+                    if 'pdf' not in content_type.lower():
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"URL {url} does not return a PDF"
+                        )
+                    
+                    if int(response.headers.get('content-length') or 0) > max_file_bytes:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"PDF at {url} too large. Max size: {settings.MAX_UPLOAD_SIZE}MB"
+                        )
+                    
+                    # Enforce both limits while streaming too; Content-Length may be absent or wrong
+                    file_bytes = 0
+                    async with aiofiles.open(temp_path, 'wb', buffering=UPLOAD_CHUNK_SIZE) as f:
+                        async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                            file_bytes += len(chunk)
+                            total_bytes += len(chunk)
+                            if file_bytes > max_file_bytes:
+                                raise HTTPException(
+                                    status_code=413,
+                                    detail=f"PDF at {url} too large. Max size: {settings.MAX_UPLOAD_SIZE}MB"
+                                )
+                            if total_bytes > max_total_bytes:
+                                raise HTTPException(
+                                    status_code=413,
+                                    detail=f"Downloads exceed {settings.MAX_MERGE_DOWNLOAD_SIZE}MB in total"
+                                )
+                            await f.write(chunk)
+            except (httpx.HTTPError, TimeoutError, ValueError) as e:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Failed to download from {url}: {str(e)}"
+                    detail=f"Failed to download from {url}: {str(e) or 'timed out'}"
                 )
+        return temp_path
+    
+    try:
+        # Download all PDFs concurrently over the shared client
+        results = await asyncio.gather(
+            *(fetch(url) for url in request.urls),
+            return_exceptions=True
+        )
+        
+        saved_paths = [r for r in results if isinstance(r, Path)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
         
-        pdf_path = pdf_service.merge_pdfs(saved_paths)
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(pdf_service.merge_pdfs, saved_paths)
         
+        background.add_task(cleanup_dir, req_dir)
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=merged_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except HTTPException:
+        cleanup_dir(req_dir)
         raise
     except Exception as e:
+        cleanup_dir(req_dir)
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        for path in saved_paths:
-            cleanup_file(path)
 
 @router.post("/merge-from-base64")
-async def merge_pdfs_from_base64(request: MergePDFsFromBase64Request):
+async def merge_pdfs_from_base64(
+    background: BackgroundTasks,
+    request: MergePDFsFromBase64Request,
+    pdf_service: PDFService = Depends(get_pdf)
+):
     """Merge PDFs from base64-encoded strings"""
     if len(request.pdfs) > 50:
         raise HTTPException(
@@ -244,46 +358,57 @@ async def merge_pdfs_from_base64(request: MergePDFsFromBase64Request):
             detail="Too many PDFs. Max 50 per request"
         )
     
-    saved_paths = []
-    
     try:
+        # Check the %PDF magic from the first 8 chars (6 bytes) before decoding it all
+        # (leading whitespace is skipped, as the full decode below ignores it)
         for idx, pdf_b64 in enumerate(request.pdfs):
             try:
-                pdf_bytes = base64.b64decode(pdf_b64)
+                head = pybase64.b64decode(pdf_b64.lstrip()[:8])
             except Exception:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Invalid base64 at index {idx}"
                 )
             
-            if not pdf_bytes.startswith(b'%PDF'):
+            if not head.startswith(b'%PDF'):
                 raise HTTPException(
                     status_code=400,
                     detail=f"Data at index {idx} is not a PDF"
                 )
-            
-            temp_path = settings.UPLOAD_DIR / generate_filename("pdf")
-            with open(temp_path, 'wb') as f:
-                f.write(pdf_bytes)
-            
-            saved_paths.append(temp_path)
         
-        pdf_path = pdf_service.merge_pdfs(saved_paths)
+        # Decode all payloads concurrently off the event loop
+        decoded = await asyncio.gather(
+            *(asyncio.to_thread(pybase64.b64decode, pdf_b64) for pdf_b64 in request.pdfs),
+            return_exceptions=True
+        )
         
+        for idx, pdf_bytes in enumerate(decoded):
+            if isinstance(pdf_bytes, Exception):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid base64 at index {idx}"
+                )
+        
+        # Merge straight from memory; no temp-file round trip
+        async with PDF_SEMAPHORE:
+            pdf_path, stat_result = await _render_pdf(
+                pdf_service.merge_pdf_streams,
+                [io.BytesIO(b) for b in decoded]
+            )
+        
+        background.add_task(cleanup_file, pdf_path)
         return FileResponse(
             path=pdf_path,
+            stat_result=stat_result,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f"inline; filename=merged_{pdf_path.name}",
                 "Content-Type": "application/pdf"
-            }
+            },
+            background=background
         )
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        for path in saved_paths:
-            cleanup_file(path)
@@ -1,15 +1,212 @@
 """
-Simple web scraping service using requests + BeautifulSoup
+Simple web scraping service using aiohttp + lxml
 No Playwright, no Crawl4AI - works on any platform
 """
-import requests
-from typing import Dict, List, Optional
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+import asyncio
+import hashlib
+import time
+import aiohttp
+from yarl import URL
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+import lxml.html
+from lxml import etree
 from app.config import settings
+from app.concurrency import run_parse
+
+# Parsed pages kept for repeat metadata requests
+METADATA_CACHE_SIZE = 512
+
+# Links of each kind returned by scrape_metadata, and hrefs resolved per batch
+METADATA_LINK_LIMIT = 10
+LINK_BATCH_SIZE = 32
+
+# Response meta key -> <meta name=...> / <meta property=...>
+META_NAMES = {"description": "description", "keywords": "keywords", "author": "author"}
+META_PROPS = {"og_title": "og:title", "og_description": "og:description", "og_image": "og:image"}
+
+def _origin(url: URL) -> Tuple[Optional[str], Optional[int]]:
+    """Host and explicit port (if any), like the netloc comparison this replaced"""
+    return url.host, url.explicit_port
+
+def _is_relative(href: str) -> bool:
+    """True if href has no scheme or authority, i.e. it stays on the page's origin"""
+    if href.startswith("//"):
+        return False
+    colon = href.find(":")
+    if colon == -1:
+        return True
+    # A colon after the first path/query/fragment delimiter isn't a scheme
+    return any(0 <= href.find(c) < colon for c in "/?#")
+
+def _resolve_links(base: URL, hrefs) -> List[URL]:
+    """Resolve hrefs against base in one pass; malformed hrefs are dropped"""
+    try:
+        return [base.join(URL(href)) for href in hrefs]
+    except ValueError:
+        # Rare: a bad href somewhere, so redo it one link at a time
+        resolved = []
+        for href in hrefs:
+            try:
+                resolved.append(base.join(URL(href)))
+            except ValueError:
+                continue
+        return resolved
+
+def _canon(url: str) -> str:
+    """Cache/dedupe key: no fragment, lowercase host, no default port"""
+    u = URL(url).with_fragment(None)
+    if u.explicit_port is not None and u.is_default_port():
+        u = u.with_port(None)
+    return str(u)
+
+class _TargetExtractor:
+    """
+    lxml parser target that collects title, meta tags, hrefs and
+    (optionally) visible text in one pass, without building a tree
+    """
+    
+    SKIP_TEXT = frozenset({"script", "style"})
+    
+    __slots__ = (
+        "title", "meta_by_name", "meta_by_property", "a_hrefs", "text_parts",
+        "_collect_text", "_buffer", "_title_parts", "_skip_depth"
+    )
+    
+    def __init__(self, collect_text: bool = False):
+        self.title: Optional[str] = None
+        self.meta_by_name: Dict[str, Optional[str]] = {}
+        self.meta_by_property: Dict[str, Optional[str]] = {}
+        self.a_hrefs: List[str] = []
+        self.text_parts: List[str] = []
+        self._collect_text = collect_text
+        self._buffer: List[str] = []
+        self._title_parts: Optional[List[str]] = None
+        self._skip_depth = 0
+    
+    def _flush(self) -> None:
+        # Each run of data between tags is one text node
+        if self._buffer:
+            chunk = "".join(self._buffer).strip()
+            self._buffer = []
+            if chunk:
+                self.text_parts.append(chunk)
+    
+    def start(self, tag, attrs) -> None:
+        self._flush()
+        if tag == "title" and self.title is None:
+            self._title_parts = []
+        elif tag == "meta":
+            content = attrs.get("content")
+            if "name" in attrs:
+                self.meta_by_name.setdefault(attrs["name"], content)
+            if "property" in attrs:
+                self.meta_by_property.setdefault(attrs["property"], content)
+        elif tag == "a":
+            href = attrs.get("href")
+            if href is not None:
+                self.a_hrefs.append(href)
+        if tag in self.SKIP_TEXT:
+            self._skip_depth += 1
+    
+    def end(self, tag) -> None:
+        self._flush()
+        if tag == "title" and self._title_parts is not None:
+            self.title = "".join(self._title_parts).strip() or None
+            self._title_parts = None
+        if tag in self.SKIP_TEXT and self._skip_depth:
+            self._skip_depth -= 1
+    
+    def data(self, data) -> None:
+        # Only buffer text that will be kept
+        if self._collect_text and not self._skip_depth:
+            self._buffer.append(data)
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+    
+    def close(self) -> "_TargetExtractor":
+        self._flush()
+        return self
+
+def _html_source(content: bytes, charset: Optional[str]) -> Union[str, bytes]:
+    """
+    Body to hand to lxml. Without an HTTP charset, strict UTF-8 is tried first:
+    libxml2 only sniffs <meta charset> and otherwise assumes Latin-1
+    """
+    if charset:
+        return content
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content
+    # lxml refuses str input with an XML encoding declaration
+    if text[:64].lstrip("\ufeff \t\r\n").startswith("<?xml"):
+        return content
+    return text
+
+def _html_parser(parser_cls, charset: Optional[str], **kwargs):
+    """Parser that decodes bytes using the HTTP charset, if libxml2 knows it"""
+    if charset:
+        try:
+            return parser_cls(encoding=charset, **kwargs)
+        except LookupError:
+            pass
+    return parser_cls(**kwargs)
+
+def _extract(
+    content: bytes,
+    charset: Optional[str] = None,
+    collect_text: bool = False
+) -> _TargetExtractor:
+    """Run one streaming parse of an HTML body"""
+    parser = _html_parser(etree.HTMLParser, charset, target=_TargetExtractor(collect_text))
+    return etree.fromstring(_html_source(content, charset), parser)
+
+def _parse_metadata_body(
+    content: bytes,
+    charset: Optional[str]
+) -> Tuple[Optional[str], Dict, Tuple[str, ...]]:
+    """Title, meta tags and raw hrefs in a single streaming pass"""
+    page = _extract(content, charset)
+    return (
+        page.title,
+        {
+            **{key: page.meta_by_name.get(name) for key, name in META_NAMES.items()},
+            **{key: page.meta_by_property.get(prop) for key, prop in META_PROPS.items()},
+        },
+        tuple(page.a_hrefs)
+    )
+
+def _parse_deep_page(
+    body: bytes,
+    charset: Optional[str],
+    page_url: str,
+    base_origin: Optional[Tuple[Optional[str], Optional[int]]]
+) -> Tuple[_TargetExtractor, List[str]]:
+    """
+    One streaming pass for title, text (minus script/style) and links
+    Links are only kept when base_origin is given and matches
+    """
+    page = _extract(body, charset, collect_text=True)
+    
+    links = []
+    if base_origin is not None:
+        links = [
+            str(link) for link in _resolve_links(URL(page_url), page.a_hrefs)
+            if _origin(link) == base_origin
+        ]
+    return page, links
 
 class CrawlerService:
-    """Simple web scraping using requests"""
+    """Simple web scraping using aiohttp"""
+    
+    # Compiled once; elements scrape_simple drops before taking text
+    _BOILERPLATE_XP = etree.XPath('//script|//style|//nav|//footer|//header')
+    
+    __slots__ = (
+        "headers", "timeout", "session", "_session_lock", "_semaphore", "_fetching",
+        "_inflight", "_metadata_cache", "_page_cache", "_page_cache_bytes"
+    )
     
     def __init__(self):
         self.headers = {
@@ -18,26 +215,122 @@ class CrawlerService:
             'Accept-Language': 'en-US,en;q=0.5',
         }
         self.timeout = settings.CRAWL_TIMEOUT
+        
+        # One pooled session reused across requests, created on first use
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        # Caps open sockets across all crawls (file descriptors are finite)
+        self._semaphore = asyncio.BoundedSemaphore(settings.CRAWL_MAX_INFLIGHT)
+        self._fetching = 0  # Fetches currently holding a slot
+        
+        # Scrapes currently running, so identical concurrent requests share one
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        
+        # Parsed metadata keyed by a digest of the page body (LRU)
+        self._metadata_cache: OrderedDict = OrderedDict()
+        
+        # Deep-crawl bodies keyed by canonical URL: (expires_at, body, charset) (LRU)
+        self._page_cache: OrderedDict = OrderedDict()
+        self._page_cache_bytes = 0
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Build the shared session once, even under concurrent first calls
+        Keep this on aiohttp: its connector hands out pooled connections in
+        O(1), whereas httpx's pool degrades badly with many queued requests
+        """
+        if self.session is None:
+            async with self._session_lock:
+                if self.session is None:
+                    self.session = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector(
+                            limit=settings.CRAWL_MAX_INFLIGHT,
+                            limit_per_host=8,
+                            ttl_dns_cache=300
+                        ),
+                        headers=self.headers,
+                        timeout=aiohttp.ClientTimeout(total=self.timeout)
+                    )
+        return self.session
+    
+    async def _fetch(self, url: str, cache: bool = False) -> Tuple[bytes, Optional[str]]:
+        """
+        Fetch URL on the shared session; returns (body, charset)
+        cache: reuse/keep the body for CRAWL_CACHE_TTL (deep crawls only)
+        """
+        key = _canon(url)
+        if cache:
+            cached = self._page_cache.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self._page_cache.move_to_end(key)
+                    return cached[1], cached[2]
+                self._evict_page(key)
+        
+        session = await self._get_session()
+        async with self._semaphore:
+            self._fetching += 1
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    body, charset = await response.read(), response.charset
+            finally:
+                self._fetching -= 1
+        
+        # Bodies over an eighth of the byte budget aren't worth evicting others for
+        max_bytes = settings.CRAWL_CACHE_MAX_SIZE * 1024 * 1024
+        if cache and len(body) <= max_bytes // 8:
+            self._evict_page(key)
+            self._page_cache[key] = (time.monotonic() + settings.CRAWL_CACHE_TTL, body, charset)
+            self._page_cache_bytes += len(body)
+            while (
+                len(self._page_cache) > settings.CRAWL_CACHE_SIZE
+                or self._page_cache_bytes > max_bytes
+            ):
+                self._evict_page(next(iter(self._page_cache)))
+        return body, charset
+    
+    def _evict_page(self, key: str) -> None:
+        """Drop a cached body, keeping the byte count in step"""
+        entry = self._page_cache.pop(key, None)
+        if entry is not None:
+            self._page_cache_bytes -= len(entry[1])
+    
+    def connection_stats(self) -> Dict:
+        """In-flight fetches against the CRAWL_MAX_INFLIGHT cap, for diagnostics"""
+        return {"in_use": self._fetching, "limit": settings.CRAWL_MAX_INFLIGHT}
+    
+    async def _shared(self, key: Tuple, scrape: Callable[[], Awaitable[Dict]]) -> Dict:
+        """Run scrape() once per key; concurrent callers await the same result"""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(scrape())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one caller disconnecting doesn't cancel the others
+        return await asyncio.shield(fut)
+    
+    async def aclose(self) -> None:
+        """Release pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
     
     async def scrape_simple(self, url: str) -> Dict:
         """Simple scrape - returns cleaned text"""
+        return await self._shared(("simple", url), lambda: self._scrape_simple(url))
+    
+    async def _scrape_simple(self, url: str) -> Dict:
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
+            body, charset = await self._fetch(url)
             
-            soup = BeautifulSoup(response.content, 'lxml')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "nav", "footer", "header"]):
-                script.decompose()
-            
-            text = soup.get_text(separator='\n', strip=True)
+            text, title = await run_parse(self._parse_simple, body, charset)
             
             return {
                 "url": url,
                 "success": True,
                 "text": text,
-                "title": self._extract_title(soup),
+                "title": title,
                 "error": None
             }
         except Exception as e:
@@ -51,14 +344,16 @@ class CrawlerService:
     
     async def scrape_html(self, url: str) -> Dict:
         """Fetch raw HTML"""
+        return await self._shared(("html", url), lambda: self._scrape_html(url))
+    
+    async def _scrape_html(self, url: str) -> Dict:
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
+            body, charset = await self._fetch(url)
             
             return {
                 "url": url,
                 "success": True,
-                "html": response.text,
+                "html": body.decode(charset or 'utf-8', errors='replace'),
                 "error": None
             }
         except Exception as e:
@@ -75,42 +370,45 @@ class CrawlerService:
     
     async def scrape_metadata(self, url: str) -> Dict:
         """Extract page metadata"""
+        return await self._shared(("metadata", url), lambda: self._scrape_metadata(url))
+    
+    async def _scrape_metadata(self, url: str) -> Dict:
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
+            body, charset = await self._fetch(url)
             
-            soup = BeautifulSoup(response.content, 'lxml')
+            title, meta, hrefs = await self._parse_metadata(body, charset)
             
-            # Extract all links
-            base_domain = urlparse(url).netloc
+            # Classify links in batches, stopping once both lists are full
+            base = URL(url)
+            base_origin = _origin(base)
             internal_links = []
             external_links = []
             
-            for a in soup.find_all('a', href=True):
-                try:
-                    full_url = urljoin(url, a.get('href'))
-                    if urlparse(full_url).netloc == base_domain:
-                        internal_links.append(full_url)
-                    else:
-                        external_links.append(full_url)
-                except:
-                    continue
+            for start in range(0, len(hrefs), LINK_BATCH_SIZE):
+                batch = hrefs[start:start + LINK_BATCH_SIZE]
+                if len(internal_links) >= METADATA_LINK_LIMIT:
+                    # Relative hrefs can only be internal; skip them unresolved
+                    batch = [href for href in batch if not _is_relative(href)]
+                for full_url in _resolve_links(base, batch):
+                    if _origin(full_url) == base_origin:
+                        if len(internal_links) < METADATA_LINK_LIMIT:
+                            internal_links.append(str(full_url))
+                    elif len(external_links) < METADATA_LINK_LIMIT:
+                        external_links.append(str(full_url))
+                if (
+                    len(internal_links) >= METADATA_LINK_LIMIT
+                    and len(external_links) >= METADATA_LINK_LIMIT
+                ):
+                    break
             
             return {
                 "url": url,
                 "success": True,
-                "title": self._extract_title(soup),
-                "meta": {
-                    "description": self._get_meta_content(soup, "description"),
-                    "keywords": self._get_meta_content(soup, "keywords"),
-                    "author": self._get_meta_content(soup, "author"),
-                    "og_title": self._get_meta_property(soup, "og:title"),
-                    "og_description": self._get_meta_property(soup, "og:description"),
-                    "og_image": self._get_meta_property(soup, "og:image"),
-                },
-                "links_count": len(internal_links) + len(external_links),
-                "internal_links": internal_links[:10],
-                "external_links": external_links[:10]
+                "title": title,
+                "meta": dict(meta),
+                "links_count": len(hrefs),
+                "internal_links": internal_links,
+                "external_links": external_links
             }
         except Exception as e:
             return {
@@ -126,53 +424,69 @@ class CrawlerService:
         same_domain_only: bool = True
     ) -> Dict:
         """Deep scrape - crawl multiple pages"""
+        return await self._shared(
+            ("deep", url, max_pages, same_domain_only),
+            lambda: self._scrape_deep(url, max_pages, same_domain_only)
+        )
+    
+    async def _scrape_deep(
+        self,
+        url: str,
+        max_pages: int,
+        same_domain_only: bool
+    ) -> Dict:
         max_pages = min(max_pages, settings.MAX_CRAWL_PAGES)
         
-        visited = set()
+        seen = {_canon(url)}  # Canonical URLs crawled or already queued
+        crawled = 0
         results = []
-        to_visit = [url]
+        frontier = deque([url])
+        pending = set()
         
-        base_domain = urlparse(url).netloc if same_domain_only else None
+        base_origin = _origin(URL(url)) if same_domain_only else None
+        sem = asyncio.Semaphore(settings.CRAWL_CONCURRENCY)
         
-        try:
-            while to_visit and len(visited) < max_pages:
-                current_url = to_visit.pop(0)
-                
-                if current_url in visited:
-                    continue
+        async def crawl_page(page_url: str) -> Optional[Tuple[Dict, List[str]]]:
+            """Fetch and parse one page; returns (result, same-domain links)"""
+            try:
+                async with sem:
+                    body, charset = await self._fetch(page_url, cache=True)
                 
-                visited.add(current_url)
+                # Parse off the event loop so other fetches keep progressing
+                page, links = await run_parse(
+                    _parse_deep_page, body, charset, page_url, base_origin
+                )
                 
-                try:
-                    response = requests.get(current_url, headers=self.headers, timeout=self.timeout)
-                    response.raise_for_status()
-                    
-                    soup = BeautifulSoup(response.content, 'lxml')
-                    
-                    # Remove script and style
-                    for script in soup(["script", "style"]):
-                        script.decompose()
-                    
-                    text = soup.get_text(separator='\n', strip=True)
-                    
-                    results.append({
-                        "url": current_url,
-                        "title": self._extract_title(soup),
-                        "text": text[:1000],
-                    })
-                    
-                    # Extract links
-                    if same_domain_only:
-                        for a in soup.find_all('a', href=True):
-                            try:
-                                link = urljoin(current_url, a.get('href'))
-                                if urlparse(link).netloc == base_domain and link not in visited:
-                                    to_visit.append(link)
-                            except:
-                                continue
+                return {
+                    "url": page_url,
+                    "title": page.title,
+                    "text": '\n'.join(page.text_parts)[:1000],
+                }, links
+            except Exception:
+                return None
+        
+        try:
+            # Breadth-first order, but pages are handled as they complete so
+            # one slow page doesn't hold back links found on the others
+            while frontier or pending:
+                while frontier and crawled < max_pages:
+                    pending.add(asyncio.ensure_future(crawl_page(frontier.popleft())))
+                    crawled += 1
+                if not pending:
+                    break
                 
-                except Exception:
-                    continue
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = task.result()
+                    if page is None:
+                        continue
+                    result, links = page
+                    results.append(result)
+                    for link in links:
+                        key = _canon(link)
+                        if key not in seen:
+                            seen.add(key)
+                            frontier.append(link)
             
             return {
                 "start_url": url,
@@ -186,30 +500,46 @@ class CrawlerService:
                 "error": str(e),
                 "pages": []
             }
+        finally:
+            # Only non-empty if the crawl errored or was cancelled
+            for task in pending:
+                task.cancel()
     
-    def _extract_title(self, soup: BeautifulSoup) -> Optional[str]:
-        """Extract page title"""
-        try:
-            title_tag = soup.find('title')
-            return title_tag.string.strip() if title_tag and title_tag.string else None
-        except:
-            return None
-    
-    def _get_meta_content(self, soup: BeautifulSoup, name: str) -> Optional[str]:
-        """Get meta tag content by name"""
-        try:
-            tag = soup.find('meta', attrs={'name': name})
-            return tag.get('content') if tag else None
-        except:
-            return None
+    def _parse_simple(self, body: bytes, charset: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Cleaned text and title of a page (runs in the parse pool)"""
+        if not body.strip():
+            return "", None
+        doc = lxml.html.fromstring(
+            _html_source(body, charset),
+            parser=_html_parser(lxml.html.HTMLParser, charset)
+        )
+        
+        # Empty out boilerplate elements; clear() keeps the text that follows them
+        for el in self._BOILERPLATE_XP(doc):
+            el.clear(keep_tail=True)
+        
+        text = '\n'.join(s for s in (t.strip() for t in doc.itertext()) if s)
+        title = doc.findtext('.//title')
+        return text, (title.strip() or None) if title else None
     
-    def _get_meta_property(self, soup: BeautifulSoup, property_name: str) -> Optional[str]:
-        """Get meta tag content by property"""
-        try:
-            tag = soup.find('meta', attrs={'property': property_name})
-            return tag.get('content') if tag else None
-        except:
-            return None
-
-# Singleton instance
-crawler_service = CrawlerService()
+    async def _parse_metadata(
+        self,
+        content: bytes,
+        charset: Optional[str]
+    ) -> Tuple[Optional[str], Dict, Tuple[str, ...]]:
+        """
+        Parse title, meta tags and raw hrefs from a page body
+        Identical bodies (re-fetched pages) are served from an LRU cache
+        """
+        key = (hashlib.blake2b(content, digest_size=16).digest(), len(content), charset)
+        cached = self._metadata_cache.get(key)
+        if cached is not None:
+            self._metadata_cache.move_to_end(key)
+            return cached
+        
+        parsed = await run_parse(_parse_metadata_body, content, charset)
+        
+        self._metadata_cache[key] = parsed
+        if len(self._metadata_cache) > METADATA_CACHE_SIZE:
+            self._metadata_cache.popitem(last=False)
+        return parsed
@@ -2,21 +2,111 @@
 FFmpeg service - Video/audio processing
 NO AI features (transcription, captioning removed)
 """
+import os
+import asyncio
 import subprocess
-import json
+import zipfile
+import orjson
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from app.config import settings
+from app.concurrency import CPU_COUNT
 from app.utils import generate_filename
 
+@lru_cache(maxsize=1)
+def _nvenc_available() -> bool:
+    """
+    Whether h264_nvenc actually works here (probed once per process)
+    Listing it in -encoders isn't enough; static builds ship it without a GPU
+    """
+    try:
+        result = subprocess.run(
+            [
+                'ffmpeg', '-hide_banner', '-v', 'error',
+                '-f', 'lavfi', '-i', 'nullsrc=s=256x256:d=0.1',
+                '-c:v', 'h264_nvenc', '-f', 'null', '-'
+            ],
+            capture_output=True,
+            timeout=15
+        )
+        return result.returncode == 0
+    except:
+        return False
+
+# Containers that take -movflags +faststart
+MOOV_FORMATS = {"mp4", "mov", "m4v"}
+
+# Encoder args per thumbnail format; libwebp is smaller and faster than mjpeg
+THUMBNAIL_CODECS = {
+    "webp": ['-c:v', 'libwebp', '-quality', '80', '-compression_level', '4'],
+    "jpg": ['-q:v', '3'],
+}
+
+def _parse_rate(rate: str) -> float:
+    """ffprobe rational like "30000/1001" -> fps (0.0 if undefined)"""
+    num, _, den = rate.partition('/')
+    try:
+        num, den = float(num), float(den or 1)
+    except ValueError:
+        return 0.0
+    return num / den if den else 0.0
+
 class FFmpegService:
     """Local FFmpeg video/audio processing"""
     
     def __init__(self):
-        self.threads = settings.FFMPEG_THREADS
+        # x264 stops scaling past a few threads; run more jobs side by side instead
+        self.threads = min(4, settings.FFMPEG_THREADS)
+        encode_jobs = settings.FFMPEG_ENCODE_JOBS or max(1, CPU_COUNT // self.threads)
         self.preset = settings.FFMPEG_PRESET
+        
+        # GPU encode/decode when available ("auto"), forced ("nvenc") or off ("none")
+        hwaccel = settings.FFMPEG_HWACCEL
+        self.nvenc = hwaccel == "nvenc" or (hwaccel == "auto" and _nvenc_available())
+        
+        # Stream-copy jobs are I/O-bound; re-encodes are CPU-bound and get few slots
+        self._copy_sem = asyncio.Semaphore(settings.FFMPEG_COPY_JOBS)
+        self._encode_sem = asyncio.Semaphore(encode_jobs)
+    
+    async def _run(self, cmd: List[str], sem: asyncio.Semaphore) -> bytes:
+        """
+        Run an ffmpeg/ffprobe command as an asyncio subprocess under `sem`
+        Returns stdout; raises CalledProcessError on a non-zero exit
+        """
+        async with sem:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await proc.communicate()
+            except BaseException:
+                # Request cancelled: don't leave ffmpeg running
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                raise
+        
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        return stdout
     
-    def get_media_info(self, file_path: Path) -> Dict:
+    async def _encode(self, gpu_cmd: List[str], cpu_cmd: List[str]) -> None:
+        """
+        Run the NVENC command when enabled, else (or if it fails) the libx264 one
+        Raises CalledProcessError from the CPU run
+        """
+        if self.nvenc:
+            try:
+                await self._run(gpu_cmd, self._encode_sem)
+                return
+            except subprocess.CalledProcessError:
+                pass  # e.g. codec NVDEC can't decode; redo on the CPU
+        await self._run(cpu_cmd, self._encode_sem)
+    
+    async def get_media_info(self, file_path: Path) -> Dict:
         """Get detailed media information using ffprobe"""
         try:
             cmd = [
@@ -28,14 +118,7 @@ class FFmpegService:
                 str(file_path)
             ]
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            data = json.loads(result.stdout)
+            data = orjson.loads(await self._run(cmd, self._copy_sem))
             
             # Extract key info
             format_info = data.get('format', {})
@@ -54,7 +137,7 @@ class FFmpegService:
                     "codec": video_stream.get('codec_name') if video_stream else None,
                     "width": video_stream.get('width') if video_stream else None,
                     "height": video_stream.get('height') if video_stream else None,
-                    "fps": eval(video_stream.get('r_frame_rate', '0/1')) if video_stream else None
+                    "fps": _parse_rate(video_stream.get('r_frame_rate', '0/1')) if video_stream else None
                 } if video_stream else None,
                 "audio": {
                     "codec": audio_stream.get('codec_name') if audio_stream else None,
@@ -69,13 +152,13 @@ class FFmpegService:
                 "error": str(e)
             }
     
-    def trim_video(
+    async def trim_video(
         self,
         input_path: Path,
         start_time: float,
         end_time: Optional[float] = None,
         duration: Optional[float] = None
-    ) -> Tuple[bool, Path, str]:
+    ) -> Tuple[bool, Path, os.stat_result, str]:
         """
         Trim video
         Use either end_time OR duration, not both
@@ -96,83 +179,142 @@ class FFmpegService:
         
         cmd.extend([
             '-c', 'copy',  # Copy without re-encoding (fast)
+            '-movflags', '+faststart',
             '-y',
             str(output_path)
         ])
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True, output_path, "Video trimmed successfully"
+            await self._run(cmd, self._copy_sem)
+            return True, output_path, output_path.stat(), "Video trimmed successfully"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
     
-    def merge_videos(self, input_paths: List[Path]) -> Tuple[bool, Path, str]:
+    async def trim_video_batch(
+        self,
+        input_path: Path,
+        segments: List[Tuple[float, float]]
+    ) -> Tuple[bool, Path, os.stat_result, str]:
+        """
+        Cut several (start, end) clips from one source in a single ffmpeg run
+        The source is demuxed once and feeds every output; clips are returned as a zip
+        """
+        clip_paths = [settings.OUTPUT_DIR / generate_filename("mp4") for _ in segments]
+        
+        cmd = ['ffmpeg', '-i', str(input_path), '-threads', str(self.threads)]
+        for (start, end), clip_path in zip(segments, clip_paths):
+            cmd.extend([
+                '-ss', str(start),
+                '-to', str(end),
+                '-c', 'copy',
+                '-movflags', '+faststart',
+                '-y',
+                str(clip_path)
+            ])
+        
+        try:
+            await self._run(cmd, self._copy_sem)
+            
+            output_path = settings.OUTPUT_DIR / generate_filename("zip")
+            await asyncio.to_thread(self._zip_clips, clip_paths, output_path)
+            return True, output_path, output_path.stat(), f"Cut {len(segments)} clips"
+        except subprocess.CalledProcessError as e:
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
+        finally:
+            for clip_path in clip_paths:
+                clip_path.unlink(missing_ok=True)
+    
+    def _zip_clips(self, clip_paths: List[Path], output_path: Path) -> None:
+        """Store clips uncompressed (MP4 doesn't deflate) as clip_01.mp4, ..."""
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED) as zf:
+            for i, clip_path in enumerate(clip_paths, 1):
+                zf.write(clip_path, f"clip_{i:02d}.mp4")
+    
+    async def merge_videos(self, input_paths: List[Path]) -> Tuple[bool, Path, os.stat_result, str]:
         """Merge multiple videos"""
-        # Create concat file
+        # Create concat file in one write
         concat_file = settings.TEMP_DIR / generate_filename("txt")
-        with open(concat_file, 'w') as f:
-            for path in input_paths:
-                f.write(f"file '{path.absolute()}'\n")
+        concat_file.write_text("".join(f"file '{path.absolute()}'\n" for path in input_paths))
         
         output_path = settings.OUTPUT_DIR / generate_filename("mp4")
         
         cmd = [
             'ffmpeg',
+            '-fflags', '+genpts',
             '-f', 'concat',
             '-safe', '0',
             '-i', str(concat_file),
             '-c', 'copy',
             '-threads', str(self.threads),
+            '-movflags', '+faststart',
             '-y',
             str(output_path)
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            concat_file.unlink()  # Cleanup
-            return True, output_path, f"Merged {len(input_paths)} videos"
+            await self._run(cmd, self._copy_sem)
+            return True, output_path, output_path.stat(), f"Merged {len(input_paths)} videos"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
+        finally:
+            concat_file.unlink(missing_ok=True)
     
-    def resize_video(
+    async def resize_video(
         self,
         input_path: Path,
         width: int,
         height: int,
         maintain_aspect: bool = True
-    ) -> Tuple[bool, Path, str]:
+    ) -> Tuple[bool, Path, os.stat_result, str]:
         """Resize video"""
         output_path = settings.OUTPUT_DIR / generate_filename("mp4")
         
+        scale_args = f"{width}:{height}"
         if maintain_aspect:
-            scale_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease"
-        else:
-            scale_filter = f"scale={width}:{height}"
+            scale_args += ":force_original_aspect_ratio=decrease"
         
         cmd = [
             'ffmpeg',
             '-i', str(input_path),
-            '-vf', scale_filter,
+            '-vf', f"scale={scale_args}",
             '-c:v', 'libx264',
             '-preset', self.preset,
             '-c:a', 'copy',
             '-threads', str(self.threads),
+            '-movflags', '+faststart',
+            '-y',
+            str(output_path)
+        ]
+        
+        # Decode, scale and encode on the GPU; frames stay in VRAM
+        gpu_cmd = [
+            'ffmpeg',
+            '-hwaccel', 'cuda',
+            '-hwaccel_output_format', 'cuda',
+            '-i', str(input_path),
+            '-vf', f"scale_cuda={scale_args}",
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-bf', '3',
+            '-rc-lookahead', '20',
+            '-c:a', 'copy',
+            '-movflags', '+faststart',
             '-y',
             str(output_path)
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True, output_path, f"Resized to {width}x{height}"
+            await self._encode(gpu_cmd, cmd)
+            return True, output_path, output_path.stat(), f"Resized to {width}x{height}"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
     
-    def compress_video(
+    async def compress_video(
         self,
         input_path: Path,
         crf: int = 23,  # 0-51, lower = better quality
         max_bitrate: Optional[str] = None
-    ) -> Tuple[bool, Path, str]:
+    ) -> Tuple[bool, Path, os.stat_result, str]:
         """
         Compress video
         crf: 18 = high quality, 23 = default, 28 = lower quality
@@ -190,29 +332,48 @@ class FFmpegService:
             '-threads', str(self.threads)
         ]
         
-        if max_bitrate:
-            cmd.extend(['-maxrate', max_bitrate, '-bufsize', max_bitrate])
+        # NVENC constant-quality VBR; -cq plays the role of -crf
+        gpu_cmd = [
+            'ffmpeg',
+            '-hwaccel', 'cuda',
+            '-hwaccel_output_format', 'cuda',
+            '-i', str(input_path),
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-tune', 'hq',
+            '-rc', 'vbr',
+            '-cq', str(crf),
+            '-b:v', '0',
+            '-spatial-aq', '1',
+            '-bf', '3',
+            '-rc-lookahead', '20',
+            '-c:a', 'aac',
+            '-b:a', '128k'
+        ]
         
-        cmd.extend(['-y', str(output_path)])
+        for args in (cmd, gpu_cmd):
+            if max_bitrate:
+                args.extend(['-maxrate', max_bitrate, '-bufsize', max_bitrate])
+            args.extend(['-movflags', '+faststart', '-y', str(output_path)])
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
+            await self._encode(gpu_cmd, cmd)
             
             # Get size reduction
             original_size = input_path.stat().st_size
-            new_size = output_path.stat().st_size
-            reduction = (1 - new_size / original_size) * 100
+            stat_result = output_path.stat()
+            reduction = (1 - stat_result.st_size / original_size) * 100
             
-            return True, output_path, f"Compressed {reduction:.1f}% smaller"
+            return True, output_path, stat_result, f"Compressed {reduction:.1f}% smaller"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
     
-    def extract_audio(
+    async def extract_audio(
         self,
         input_path: Path,
         format: str = "mp3",
         bitrate: str = "192k"
-    ) -> Tuple[bool, Path, str]:
+    ) -> Tuple[bool, Path, os.stat_result, str]:
         """Extract audio from video"""
         output_path = settings.OUTPUT_DIR / generate_filename(format)
         
@@ -228,42 +389,46 @@ class FFmpegService:
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True, output_path, "Audio extracted"
+            await self._run(cmd, self._copy_sem)
+            return True, output_path, output_path.stat(), "Audio extracted"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
     
-    def generate_thumbnail(
+    async def generate_thumbnail(
         self,
         input_path: Path,
         timestamp: float = 1.0,
-        width: int = 640
-    ) -> Tuple[bool, Path, str]:
-        """Generate thumbnail from video"""
-        output_path = settings.OUTPUT_DIR / generate_filename("jpg")
+        width: int = 640,
+        fmt: str = "webp"
+    ) -> Tuple[bool, Path, os.stat_result, str]:
+        """Generate thumbnail from video (fmt: webp or jpg)"""
+        output_path = settings.OUTPUT_DIR / generate_filename(fmt)
         
+        # -ss before -i seeks in the container instead of decoding up to the
+        # timestamp; ffmpeg still decodes from the keyframe so it stays exact
         cmd = [
             'ffmpeg',
-            '-i', str(input_path),
             '-ss', str(timestamp),
+            '-i', str(input_path),
             '-vframes', '1',
             '-vf', f'scale={width}:-1',
+            *THUMBNAIL_CODECS[fmt],
             '-y',
             str(output_path)
         ]
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True, output_path, "Thumbnail generated"
+            await self._run(cmd, self._copy_sem)
+            return True, output_path, output_path.stat(), "Thumbnail generated"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
     
-    def convert_format(
+    async def convert_format(
         self,
         input_path: Path,
         output_format: str,
         codec: Optional[str] = None
-    ) -> Tuple[bool, Path, str]:
+    ) -> Tuple[bool, Path, os.stat_result, str]:
         """Convert video to different format"""
         output_path = settings.OUTPUT_DIR / generate_filename(output_format)
         
@@ -276,13 +441,14 @@ class FFmpegService:
         if codec:
             cmd.extend(['-c:v', codec])
         
+        # Put the moov atom up front so MP4/MOV output can play while downloading
+        if output_format in MOOV_FORMATS:
+            cmd.extend(['-movflags', '+faststart'])
+        
         cmd.extend(['-y', str(output_path)])
         
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            return True, output_path, f"Converted to {output_format}"
+            await self._run(cmd, self._encode_sem)
+            return True, output_path, output_path.stat(), f"Converted to {output_format}"
         except subprocess.CalledProcessError as e:
-            return False, None, f"FFmpeg error: {e.stderr.decode()}"
-
-# Singleton instance
-ffmpeg_service = FFmpegService()
+            return False, None, None, f"FFmpeg error: {e.stderr.decode()}"
@@ -1,24 +1,76 @@
 """
 Tesseract OCR service - Local image and PDF text extraction
 """
+import re
 import json
+import time
+import tempfile
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import AbstractSet, Dict, List, Optional
 import pytesseract
 from PIL import Image
 from pdf2image import convert_from_path
 import pillow_heif
 from app.config import settings
+from app.concurrency import OCR_POOL
 
 # Register HEIF support
 pillow_heif.register_heif_opener()
 
+# Word confidence in hOCR output, e.g. title="bbox 1 2 3 4; x_wconf 96"
+HOCR_WCONF_RE = re.compile(r"x_wconf (\d+)")
+
+def _to_grayscale(image: Image.Image) -> Image.Image:
+    """
+    Grayscale copy for Tesseract; transparent images are flattened onto white
+    first, since convert('L') would drop alpha and leave the background black
+    """
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba)
+    return image.convert('L')
+
+def _average_confidence(confs) -> Optional[float]:
+    """Mean word confidence, ignoring non-word boxes (conf -1)"""
+    scores = [float(c) for c in confs if float(c) > 0]
+    return sum(scores) / len(scores) if scores else None
+
+def _data_to_text(data: Dict) -> str:
+    """
+    Rebuild plain text from image_to_data output, as image_to_string lays it out:
+    words joined by spaces, lines by newlines, paragraphs by a blank line
+    """
+    paragraphs: List[List[List[str]]] = []
+    last_par = last_line = None
+    for word, block, par, line in zip(
+        data['text'], data['block_num'], data['par_num'], data['line_num']
+    ):
+        if not word.strip():
+            continue
+        if (block, par) != last_par:
+            paragraphs.append([])
+            last_par, last_line = (block, par), None
+        if line != last_line:
+            paragraphs[-1].append([])
+            last_line = line
+        paragraphs[-1][-1].append(word)
+    
+    return "\n\n".join(
+        "\n".join(" ".join(words) for words in lines) for lines in paragraphs
+    )
+
 class OCRService:
     """Local OCR service using Tesseract"""
     
     def __init__(self):
         self.default_lang = settings.TESSERACT_LANG
-        self.dpi = settings.OCR_DPI
+        # Tesseract gains next to nothing above 300 DPI, but cost grows with area
+        self.dpi = min(settings.OCR_DPI, 300)
+        self.max_dimension = settings.OCR_MAX_DIMENSION
+        self._languages: Optional[List[str]] = None
+        self._languages_expires = 0.0
     
     def extract_text_from_image(
         self,
@@ -31,16 +83,19 @@ class OCRService:
         Formats: text, hocr, json
         """
         try:
-            # Open image
+            # Open image; JPEG can decode straight to reduced-size grayscale
             image = Image.open(image_path)
+            image.draft('L', (self.max_dimension, self.max_dimension))
             
-            # Convert to RGB if necessary
-            if image.mode not in ('RGB', 'L'):
-                image = image.convert('RGB')
+            # Tesseract works in grayscale, and cost scales with pixel count
+            if image.mode != 'L':
+                image = _to_grayscale(image)
+            if max(image.size) > self.max_dimension:
+                image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
             
             lang = lang or self.default_lang
             
-            # Extract based on format
+            # One Tesseract pass per request; confidence comes from the same output
             if output_format == "hocr":
                 result = pytesseract.image_to_pdf_or_hocr(
                     image,
@@ -48,28 +103,18 @@ class OCRService:
                     extension='hocr'
                 )
                 text = result.decode('utf-8')
-            elif output_format == "json":
+                avg_confidence = _average_confidence(HOCR_WCONF_RE.findall(text))
+            else:
                 data = pytesseract.image_to_data(
                     image,
                     lang=lang,
                     output_type=pytesseract.Output.DICT
                 )
-                text = json.dumps(data, indent=2)
-            else:  # text
-                text = pytesseract.image_to_string(image, lang=lang)
-            
-            # Get confidence if available
-            try:
-                confidence = pytesseract.image_to_data(
-                    image,
-                    lang=lang,
-                    output_type=pytesseract.Output.DICT
-                )
-                avg_confidence = sum(
-                    int(c) for c in confidence['conf'] if int(c) > 0
-                ) / len([c for c in confidence['conf'] if int(c) > 0])
-            except:
-                avg_confidence = None
+                avg_confidence = _average_confidence(data['conf'])
+                if output_format == "json":
+                    text = json.dumps(data, indent=2)
+                else:  # text
+                    text = _data_to_text(data)
             
             return {
                 "success": True,
@@ -90,62 +135,65 @@ class OCRService:
         self,
         pdf_path: Path,
         lang: Optional[str] = None,
-        pages: Optional[List[int]] = None,
+        pages: Optional[AbstractSet[int]] = None,
         output_format: str = "text"
     ) -> Dict:
         """
         Extract text from PDF pages
-        pages: List of page numbers (1-indexed) or None for all
+        pages: Set of page numbers (1-indexed) or None for all
         """
         try:
             lang = lang or self.default_lang
             
-            # Convert PDF to images
-            if pages:
-                images = convert_from_path(
-                    pdf_path,
-                    dpi=self.dpi,
-                    first_page=min(pages),
-                    last_page=max(pages)
-                )
-            else:
-                images = convert_from_path(pdf_path, dpi=self.dpi)
-            
-            # Limit pages to prevent resource exhaustion
-            if len(images) > settings.MAX_PDF_PAGES:
-                return {
-                    "success": False,
-                    "error": f"PDF too large. Max {settings.MAX_PDF_PAGES} pages allowed"
-                }
-            
-            results = []
-            
-            for page_num, image in enumerate(images, start=1):
-                if pages and page_num not in pages:
-                    continue
-                
-                # Extract text
-                if output_format == "text":
-                    text = pytesseract.image_to_string(image, lang=lang)
-                elif output_format == "hocr":
-                    text = pytesseract.image_to_pdf_or_hocr(
-                        image,
-                        lang=lang,
-                        extension='hocr'
-                    ).decode('utf-8')
-                else:  # json
-                    data = pytesseract.image_to_data(
-                        image,
-                        lang=lang,
-                        output_type=pytesseract.Output.DICT
+            # Render pages to files rather than PIL images: memory stays flat and
+            # tesseract reads the files directly. PNG keeps the text lossless.
+            with tempfile.TemporaryDirectory(dir=settings.TEMP_DIR) as tmp_dir:
+                if pages:
+                    images = convert_from_path(
+                        pdf_path,
+                        dpi=self.dpi,
+                        first_page=min(pages),
+                        last_page=max(pages),
+                        output_folder=tmp_dir,
+                        paths_only=True,
+                        fmt='png'
                     )
-                    text = json.dumps(data, indent=2)
+                else:
+                    images = convert_from_path(
+                        pdf_path,
+                        dpi=self.dpi,
+                        output_folder=tmp_dir,
+                        paths_only=True,
+                        fmt='png'
+                    )
+                
+                # Limit pages to prevent resource exhaustion
+                if len(images) > settings.MAX_PDF_PAGES:
+                    return {
+                        "success": False,
+                        "error": f"PDF too large. Max {settings.MAX_PDF_PAGES} pages allowed"
+                    }
+                
+                # Rendering starts at the first requested page, so number from there
+                first_page = min(pages) if pages else 1
+                tasks = [
+                    (page_num, image)
+                    for page_num, image in enumerate(images, start=first_page)
+                    if not pages or page_num in pages
+                ]
                 
-                results.append({
+                # Each page is its own tesseract process, so pages OCR in parallel
+                ocr_page = partial(self._ocr_page, lang=lang, output_format=output_format)
+                texts = list(OCR_POOL.map(ocr_page, [image for _, image in tasks]))
+            
+            results = [
+                {
                     "page": page_num,
                     "text": text,
                     "char_count": len(text) if output_format == "text" else None
-                })
+                }
+                for (page_num, _), text in zip(tasks, texts)
+            ]
             
             # Combine all text if format is text
             if output_format == "text":
@@ -171,13 +219,53 @@ class OCRService:
                 "error": str(e)
             }
     
+    def _ocr_page(self, image: str, lang: str, output_format: str) -> str:
+        """OCR one rendered PDF page (image file path) in the requested format"""
+        if output_format == "text":
+            return pytesseract.image_to_string(image, lang=lang)
+        elif output_format == "hocr":
+            return pytesseract.image_to_pdf_or_hocr(
+                image,
+                lang=lang,
+                extension='hocr'
+            ).decode('utf-8')
+        else:  # json
+            data = pytesseract.image_to_data(
+                image,
+                lang=lang,
+                output_type=pytesseract.Output.DICT
+            )
+            return json.dumps(data, indent=2)
+    
+    def unknown_languages(self, lang: Optional[str]) -> List[str]:
+        """
+        Parts of a Tesseract lang spec (e.g. "eng+deu") that aren't installed
+        Nothing is rejected if the installed list can't be read
+        """
+        available = self._installed_languages()
+        if available is None:
+            return []
+        return [part for part in (lang or self.default_lang).split("+") if part not in available]
+    
     def get_available_languages(self) -> List[str]:
         """Get list of installed Tesseract languages"""
+        return self._installed_languages() or [self.default_lang]
+    
+    def _installed_languages(self) -> Optional[List[str]]:
+        """
+        Installed Tesseract languages, or None if tesseract can't be queried
+        Cached for OCR_LANGUAGES_TTL seconds to avoid a tesseract spawn per call
+        """
+        now = time.monotonic()
+        if self._languages is not None and now < self._languages_expires:
+            return self._languages
+        
         try:
-            langs = pytesseract.get_languages()
-            return sorted(langs)
+            langs = sorted(pytesseract.get_languages())
         except:
-            return [self.default_lang]
-
-# Singleton instance
-ocr_service = OCRService()
+            # Don't cache the failure so a later call can retry
+            return None
+        
+        self._languages = langs
+        self._languages_expires = now + settings.OCR_LANGUAGES_TTL
+        return langs
@@ -2,22 +2,154 @@
 PDF Generation Service - Professional Children's Book Template (COMPLETE)
 Beautiful, designed PDFs from simple text input with full customization
 """
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Dict
-import markdown
+from typing import BinaryIO, List, Optional, Dict, Tuple, Union
+import cmarkgfm
+from cmarkgfm.cmark import Options as CmarkOptions
+from PIL import Image as PILImage
 from reportlab.lib.pagesizes import A4, letter, legal
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import inch, mm
 from reportlab.lib.colors import HexColor
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image as RLImage
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.platypus.flowables import Flowable
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
 from weasyprint import HTML
+from weasyprint.text.fonts import FontConfiguration
 import img2pdf
-from PyPDF2 import PdfMerger
+import pikepdf
 from app.config import settings
 from app.utils import generate_filename
 
+# Fixed body text color, parsed once
+BODY_TEXT_COLOR = HexColor('#34495e')
+
+# Reusable renderer state per PDF worker thread (none of it is thread-safe)
+_local = threading.local()
+
+# Anything that can declare fonts (directly or via another stylesheet)
+FONT_FACE_RE = re.compile(r'@font-face|@import|<link\b', re.IGNORECASE)
+
+def _font_config(html: str) -> FontConfiguration:
+    """
+    This thread's FontConfiguration, created on first use and then reused
+    Documents that may declare @font-face get a fresh one, so their fonts
+    don't pile up on the thread or leak into later renders
+    """
+    if FONT_FACE_RE.search(html):
+        return FontConfiguration()
+    
+    font_config = getattr(_local, "font_config", None)
+    if font_config is None:
+        font_config = _local.font_config = FontConfiguration()
+    return font_config
+
+# Rendered Markdown HTML kept for repeat requests, bounded by total size
+MARKDOWN_CACHE_BYTES = 8 * 1024 * 1024
+
+# GitHub-flavoured extensions; raw HTML passes through as before
+MARKDOWN_EXTENSIONS = ['table', 'autolink', 'strikethrough']
+MARKDOWN_OPTIONS = CmarkOptions.CMARK_OPT_UNSAFE | CmarkOptions.CMARK_OPT_FOOTNOTES
+
+# Document shells, so wrapping a body is a single join
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    """
+HTML_BODY_OPEN = """
+</head>
+<body>
+"""
+HTML_TAIL = """
+</body>
+</html>"""
+
+MARKDOWN_CSS_TEMPLATE = """<style>
+        @page { size: %s; margin: 1cm; }
+        body { font-family: Arial, sans-serif; font-size: 11pt; line-height: 1.5; }
+        h1 { font-size: 20pt; margin-top: 0; }
+        h2 { font-size: 16pt; }
+        h3 { font-size: 14pt; }
+        code { background: #f4f4f4; padding: 2px 4px; }
+        pre { background: #f4f4f4; padding: 10px; }
+    </style>"""
+
+# A full document starts with a doctype or <html>; only the prefix is looked at
+HTML_DOCUMENT_RE = re.compile(r'\s*<(?:!doctype|html\b)', re.IGNORECASE)
+
+# Markdown stylesheet for the stock page sizes, filled in once at import
+MARKDOWN_CSS = {size: MARKDOWN_CSS_TEMPLATE % size for size in ("A4", "letter", "legal")}
+
+def _markdown_html(md_text: str) -> str:
+    """Markdown converted to HTML (libcmark-gfm)"""
+    return cmarkgfm.markdown_to_html_with_extensions(
+        md_text,
+        extensions=MARKDOWN_EXTENSIONS,
+        options=MARKDOWN_OPTIONS
+    )
+
+@lru_cache(maxsize=64)
+def _book_styles(
+    font_name: str,
+    title_font: str,
+    theme_color: str
+) -> Tuple[ParagraphStyle, ParagraphStyle, ParagraphStyle, ParagraphStyle]:
+    """Children's book styles: (title, body, medium, long)"""
+    title_style = ParagraphStyle(
+        'BookTitle',
+        fontName=title_font,
+        fontSize=32,
+        textColor=HexColor(theme_color),
+        alignment=TA_CENTER,
+        spaceAfter=20*mm,
+        spaceBefore=10*mm,
+        leading=40,
+        leftIndent=0,
+        rightIndent=0
+    )
+    
+    body_style = ParagraphStyle(
+        'BookBody',
+        fontName=font_name,
+        fontSize=16,
+        textColor=BODY_TEXT_COLOR,
+        alignment=TA_CENTER,
+        spaceAfter=13*mm,  # Paragraph gap, so no Spacer flowable per paragraph
+        leading=24,
+        leftIndent=0,
+        rightIndent=0,
+        wordWrap='CJK'
+    )
+    
+    # Length-based variants of the body style
+    long_style = ParagraphStyle('LongText', parent=body_style, alignment=TA_JUSTIFY)
+    medium_style = ParagraphStyle('MediumText', parent=body_style, alignment=TA_LEFT)
+    
+    return title_style, body_style, medium_style, long_style
+
+
+def _flatten_alpha(path: str, tmp_dir: Path) -> str:
+    """Composite a non-PNG image with alpha onto white; other images pass through"""
+    with PILImage.open(path) as image:
+        if image.format == "PNG" or image.mode not in ("RGBA", "LA", "PA"):
+            return path
+        
+        rgba = image.convert("RGBA")
+        flat = PILImage.new("RGB", image.size, "white")
+        flat.paste(rgba, mask=rgba)
+    
+    flat_path = tmp_dir / generate_filename("png")
+    flat.save(flat_path)
+    return str(flat_path)
+
 
 class DecorativeBorder(Flowable):
     """Custom decorative border for children's book pages"""
@@ -73,6 +205,11 @@ class PDFService:
         }
         self.default_page_size = A4
         self.margin = settings.PDF_MARGIN
+        
+        # Markdown source digest -> rendered HTML (LRU, capped at MARKDOWN_CACHE_BYTES)
+        self._markdown_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._markdown_cache_bytes = 0
+        self._markdown_lock = threading.Lock()
     
     def create_childrens_book(
         self,
@@ -121,31 +258,9 @@ class PDFService:
         font_name = self.AVAILABLE_FONTS.get(font_family, "Helvetica")
         title_font = self._get_bold_font(font_name)
         
-        # Create custom styles
-        title_style = ParagraphStyle(
-            'BookTitle',
-            fontName=title_font,
-            fontSize=32,
-            textColor=HexColor(theme_color),
-            alignment=TA_CENTER,
-            spaceAfter=20*mm,
-            spaceBefore=10*mm,
-            leading=40,
-            leftIndent=0,
-            rightIndent=0
-        )
-        
-        body_style = ParagraphStyle(
-            'BookBody',
-            fontName=font_name,
-            fontSize=16,
-            textColor=HexColor('#34495e'),
-            alignment=TA_CENTER,
-            spaceAfter=8*mm,
-            leading=24,
-            leftIndent=0,
-            rightIndent=0,
-            wordWrap='CJK'
+        # Styles are static per font/colour, so they're built once and shared
+        title_style, body_style, medium_style, long_style = _book_styles(
+            font_name, title_font, theme_color
         )
         
         # Build content
@@ -166,14 +281,13 @@ class PDFService:
             story.append(Paragraph(title.strip(), title_style))
         
         # Add body text with smart alignment
-        paragraphs = self._split_paragraphs(text)
-        
-        for para_text in paragraphs:
-            if para_text:
-                # Smart alignment based on text length
-                style = self._get_paragraph_style(para_text, body_style)
-                story.append(Paragraph(para_text, style))
-                story.append(Spacer(1, 5*mm))
+        story.extend(
+            Paragraph(
+                para_text,
+                self._get_paragraph_style(para_text, body_style, medium_style, long_style)
+            )
+            for para_text in self._split_paragraphs(text)
+        )
         
         # Build PDF
         doc.build(story)
@@ -216,31 +330,27 @@ class PDFService:
     def _split_paragraphs(self, text: str) -> List[str]:
         """Split text into paragraphs intelligently"""
         # Try double newline first
-        if '\n\n' in text:
-            paragraphs = text.split('\n\n')
-        else:
-            paragraphs = text.split('\n')
+        sep = '\n\n' if '\n\n' in text else '\n'
         
-        return [p.strip() for p in paragraphs if p.strip()]
+        # Strip each paragraph once, dropping the empty ones
+        return [p for p in (p.strip() for p in text.split(sep)) if p]
     
-    def _get_paragraph_style(self, text: str, base_style: ParagraphStyle) -> ParagraphStyle:
+    def _get_paragraph_style(
+        self,
+        text: str,
+        base_style: ParagraphStyle,
+        medium_style: ParagraphStyle,
+        long_style: ParagraphStyle
+    ) -> ParagraphStyle:
         """Get appropriate style based on text length"""
         text_length = len(text)
         
         if text_length > 150:
             # Long text - justified
-            return ParagraphStyle(
-                'LongText',
-                parent=base_style,
-                alignment=TA_JUSTIFY
-            )
+            return long_style
         elif text_length > 80:
             # Medium text - left aligned
-            return ParagraphStyle(
-                'MediumText',
-                parent=base_style,
-                alignment=TA_LEFT
-            )
+            return medium_style
         else:
             # Short text - centered
             return base_style
@@ -259,22 +369,19 @@ class PDFService:
         
         try:
             # Ensure HTML has proper structure
-            if not html.strip().startswith('<!DOCTYPE') and not html.strip().startswith('<html'):
-                html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    {f'<style>{css}</style>' if css else ''}
-</head>
-<body>
-{html}
-</body>
-</html>"""
+            if not HTML_DOCUMENT_RE.match(html):
+                html = "".join((
+                    HTML_HEAD,
+                    f'<style>{css}</style>' if css else '',
+                    HTML_BODY_OPEN,
+                    html,
+                    HTML_TAIL
+                ))
             elif css and '<head>' in html:
                 html = html.replace('</head>', f'<style>{css}</style></head>')
             
             # Generate PDF with WeasyPrint
-            HTML(string=html).write_pdf(str(output_file))
+            HTML(string=html).write_pdf(str(output_file), font_config=_font_config(html))
             
             if not output_file.exists() or output_file.stat().st_size < 100:
                 raise Exception("PDF generation failed")
@@ -291,32 +398,36 @@ class PDFService:
         style: str = "default"
     ) -> Path:
         """Convert markdown to PDF"""
-        html = markdown.markdown(
-            md_text,
-            extensions=['extra', 'codehilite', 'tables', 'toc']
-        )
+        html = self._cached_markdown_html(md_text)
         
-        full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        @page {{ size: {page_size}; margin: 1cm; }}
-        body {{ font-family: Arial, sans-serif; font-size: 11pt; line-height: 1.5; }}
-        h1 {{ font-size: 20pt; margin-top: 0; }}
-        h2 {{ font-size: 16pt; }}
-        h3 {{ font-size: 14pt; }}
-        code {{ background: #f4f4f4; padding: 2px 4px; }}
-        pre {{ background: #f4f4f4; padding: 10px; }}
-    </style>
-</head>
-<body>
-{html}
-</body>
-</html>"""
+        css = MARKDOWN_CSS.get(page_size) or MARKDOWN_CSS_TEMPLATE % page_size
+        full_html = "".join((HTML_HEAD, css, HTML_BODY_OPEN, html, HTML_TAIL))
         
         return self.create_from_html(full_html, page_size)
     
+    def _cached_markdown_html(self, md_text: str) -> str:
+        """Rendered HTML for md_text, reused across requests with the same source"""
+        key = hashlib.blake2b(md_text.encode(), digest_size=16).digest()
+        with self._markdown_lock:
+            html = self._markdown_cache.get(key)
+            if html is not None:
+                self._markdown_cache.move_to_end(key)
+                return html
+        
+        html = _markdown_html(md_text)
+        
+        # Documents over an eighth of the budget aren't worth evicting others for
+        size = len(html)
+        if size <= MARKDOWN_CACHE_BYTES // 8:
+            with self._markdown_lock:
+                if key not in self._markdown_cache:
+                    self._markdown_cache[key] = html
+                    self._markdown_cache_bytes += size
+                while self._markdown_cache_bytes > MARKDOWN_CACHE_BYTES:
+                    _, evicted = self._markdown_cache.popitem(last=False)
+                    self._markdown_cache_bytes -= len(evicted)
+        return html
+    
     def create_from_images(
         self,
         image_paths: List[Path],
@@ -327,47 +438,57 @@ class PDFService:
         output_file = settings.OUTPUT_DIR / generate_filename("pdf")
         
         if fit_to_page:
-            with open(output_file, "wb") as f:
-                f.write(img2pdf.convert([str(p) for p in image_paths]))
+            # Each page takes the image's own size
+            layout = img2pdf.default_layout_fun
         else:
-            page = self.page_sizes.get(page_size, self.default_page_size)
-            doc = SimpleDocTemplate(str(output_file), pagesize=page)
-            
-            story = []
-            for img_path in image_paths:
-                img = RLImage(str(img_path))
-                
-                img_width, img_height = img.imageWidth, img.imageHeight
-                page_width, page_height = page
-                
-                scale = min(
-                    (page_width - 2 * self.margin) / img_width,
-                    (page_height - 2 * self.margin) / img_height
-                )
-                
-                img.drawWidth = img_width * scale
-                img.drawHeight = img_height * scale
-                
-                story.append(img)
-                story.append(PageBreak())
-            
-            doc.build(story)
+            # Fixed page size; images scaled into the margins and centred
+            layout = img2pdf.get_layout_fun(
+                pagesize=self.page_sizes.get(page_size, self.default_page_size),
+                border=(self.margin, self.margin),
+                fit=img2pdf.FitMode.into
+            )
+        
+        # Compressed image data is embedded as-is, never decoded or re-encoded
+        paths = [str(p) for p in image_paths]
+        try:
+            pdf_bytes = img2pdf.convert(paths, layout_fun=layout)
+        except img2pdf.AlphaChannelError:
+            # img2pdf only keeps alpha for PNG; flatten the rest onto white
+            with tempfile.TemporaryDirectory(dir=settings.TEMP_DIR) as tmp_dir:
+                paths = [_flatten_alpha(p, Path(tmp_dir)) for p in paths]
+                pdf_bytes = img2pdf.convert(paths, layout_fun=layout)
+        
+        with open(output_file, "wb") as f:
+            f.write(pdf_bytes)
         
         return output_file
     
     def merge_pdfs(self, pdf_paths: List[Path]) -> Path:
         """Merge multiple PDFs into one"""
+        return self._merge(pdf_paths)
+    
+    def merge_pdf_streams(self, streams: List[BinaryIO]) -> Path:
+        """Merge PDFs that are already in memory (no temp files)"""
+        return self._merge(streams)
+    
+    def _merge(self, sources: List[Union[Path, BinaryIO]]) -> Path:
+        """
+        Concatenate PDFs with pikepdf (qpdf): pages are copied as objects,
+        content streams are never decoded or re-encoded
+        """
         output_file = settings.OUTPUT_DIR / generate_filename("pdf")
         
-        merger = PdfMerger()
-        for pdf_path in pdf_paths:
-            merger.append(str(pdf_path))
-        
-        merger.write(str(output_file))
-        merger.close()
+        # Sources stay open until save; copied pages still reference their streams
+        with ExitStack() as stack:
+            merged = stack.enter_context(pikepdf.Pdf.new())
+            for source in sources:
+                # Files on disk are mapped rather than read object by object
+                access_mode = (
+                    pikepdf.AccessMode.mmap if isinstance(source, Path)
+                    else pikepdf.AccessMode.default
+                )
+                pdf = stack.enter_context(pikepdf.Pdf.open(source, access_mode=access_mode))
+                merged.pages.extend(pdf.pages)
+            merged.save(output_file)
         
         return output_file
-
-
-# Singleton instance
-pdf_service = PDFService()
@@ -3,11 +3,15 @@ Utility functions for file handling, validation, and common operations
 """
 import os
 import uuid
+import shutil
+import asyncio
 import magic
 import hashlib
+import aiofiles
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
+from pydantic import HttpUrl
 from app.config import settings
 
 # Allowed file types
@@ -16,6 +20,9 @@ PDF_TYPES = {"application/pdf"}
 VIDEO_TYPES = {"video/mp4", "video/mpeg", "video/quicktime", "video/x-msvideo", "video/webm"}
 AUDIO_TYPES = {"audio/mpeg", "audio/wav", "audio/ogg", "audio/webm"}
 
+# Uploads are streamed to disk in 1 MiB chunks
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 def generate_filename(extension: str = "") -> str:
     """Generate unique filename with UUID"""
     unique_id = uuid.uuid4().hex[:12]
@@ -31,29 +38,44 @@ def get_file_hash(file_path: Path) -> str:
             sha256.update(chunk)
     return sha256.hexdigest()
 
+# Top-level types that clearly say what a file is; anything else (application/*,
+# missing, malformed) is left to magic sniffing
+MEDIA_TOP_LEVEL_TYPES = {"image", "video", "audio", "text", "font", "model"}
+
+def require_mime(upload_file: UploadFile, allowed_types: set) -> None:
+    """
+    Reject an upload before any body is read when its declared Content-Type is
+    the wrong kind entirely (e.g. text/* sent to an image endpoint)
+    Subtypes aren't compared, since clients send aliases like image/jpg or
+    audio/x-wav; save_upload_file still sniffs the actual bytes
+    """
+    top_level = (upload_file.content_type or "").split("/", 1)[0].strip().lower()
+    if top_level not in MEDIA_TOP_LEVEL_TYPES:
+        return
+    if top_level not in {t.split("/", 1)[0] for t in allowed_types}:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported media type {upload_file.content_type}"
+        )
+
 async def save_upload_file(
     upload_file: UploadFile,
     allowed_types: set,
-    max_size_mb: Optional[int] = None
+    max_size_mb: Optional[int] = None,
+    dest_dir: Optional[Path] = None
 ) -> Tuple[Path, str]:
     """
     Save uploaded file with validation
+    Streams to disk in fixed-size chunks so memory stays O(chunk)
+    dest_dir: directory to save into (defaults to UPLOAD_DIR)
     Returns: (file_path, mime_type)
     """
-    # Read file content
-    content = await upload_file.read()
-    file_size_mb = len(content) / (1024 * 1024)
-    
-    # Check size
     max_size = max_size_mb or settings.MAX_UPLOAD_SIZE
-    if file_size_mb > max_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Max size: {max_size}MB"
-        )
+    max_bytes = max_size * 1024 * 1024
     
-    # Detect MIME type
-    mime = magic.from_buffer(content, mime=True)
+    # Detect MIME type from the first chunk only
+    chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+    mime = magic.from_buffer(chunk, mime=True)
     
     # Validate type
     if mime not in allowed_types:
@@ -65,14 +87,66 @@ async def save_upload_file(
     # Generate filename with proper extension
     ext = upload_file.filename.split(".")[-1] if "." in upload_file.filename else ""
     filename = generate_filename(ext)
-    file_path = settings.UPLOAD_DIR / filename
+    file_path = (dest_dir or settings.UPLOAD_DIR) / filename
     
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Stream to disk, rejecting oversize uploads as soon as the limit is hit
+    total = 0
+    try:
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk:
+                total += len(chunk)
+                if total > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Max size: {max_size}MB"
+                    )
+                await f.write(chunk)
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        cleanup_file(file_path)
+        raise
     
     return file_path, mime
 
+async def save_upload_files(
+    upload_files: List[UploadFile],
+    allowed_types: set,
+    limit: int = 4,
+    dest_dir: Optional[Path] = None
+) -> List[Tuple[Path, str]]:
+    """
+    Save several uploads concurrently, at most `limit` writing at once
+    If any upload fails, every saved file is removed and the first error is raised
+    """
+    sem = asyncio.Semaphore(limit)
+    
+    async def _save(upload_file: UploadFile) -> Tuple[Path, str]:
+        async with sem:
+            return await save_upload_file(upload_file, allowed_types, dest_dir=dest_dir)
+    
+    results = await asyncio.gather(
+        *(_save(f) for f in upload_files),
+        return_exceptions=True
+    )
+    
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        for r in results:
+            if not isinstance(r, BaseException):
+                cleanup_file(r[0])
+        raise errors[0]
+    
+    return results
+
+async def stream_and_delete(file_path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Yield a file in fixed-size chunks, deleting it once streaming ends"""
+    try:
+        async with aiofiles.open(file_path, "rb") as f:
+            while chunk := await f.read(chunk_size):
+                yield chunk
+    finally:
+        file_path.unlink(missing_ok=True)
+
 def cleanup_file(file_path: Path) -> None:
     """Safely delete file"""
     try:
@@ -81,6 +155,10 @@ def cleanup_file(file_path: Path) -> None:
     except Exception:
         pass  # Silent fail
 
+def cleanup_dir(dir_path: Path) -> None:
+    """Safely delete a directory tree"""
+    shutil.rmtree(dir_path, ignore_errors=True)
+
 def get_file_extension(mime_type: str) -> str:
     """Get file extension from MIME type"""
     mime_map = {
@@ -100,9 +178,9 @@ def get_file_extension(mime_type: str) -> str:
     }
     return mime_map.get(mime_type, "bin")
 
-def validate_url(url: str) -> bool:
-    """Basic URL validation"""
-    return url.startswith(("http://", "https://"))
+def validate_url_obj(url: HttpUrl) -> bool:
+    """Validate an already-parsed URL without re-serializing it"""
+    return url.scheme in ("http", "https") and bool(url.host)
 
 def format_bytes(bytes_count: int) -> str:
     """Format bytes to human readable"""
@@ -75,6 +75,8 @@ exec uvicorn app.main:app \
     --host 0.0.0.0 \
     --port ${PORT} \
     --workers ${WORKERS} \
+    --loop uvloop \
+    --http httptools \
     --timeout-keep-alive 300 \
     --limit-concurrency 50 \
     --log-level info \